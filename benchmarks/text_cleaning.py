@@ -0,0 +1,92 @@
+"""
+Micro-benchmark of the sentence splitting and cleaning of TextExtractor on a real 10-K.
+
+By default the Apple 10-K of fiscal year 2023 is downloaded once into the HTTP cache, any other
+filing can be given by URL or as a path to a 10-K HTML file you saved yourself:
+
+    python benchmarks/text_cleaning.py
+    python benchmarks/text_cleaning.py --url https://www.sec.gov/Archives/edgar/data/320193/000032019323000106/aapl-20230930.htm
+    python benchmarks/text_cleaning.py --path /path/to/your/10-k.htm
+"""
+
+import argparse
+import re
+import timeit
+from pathlib import Path
+import requests
+from bs4 import BeautifulSoup
+from financial_report_analyzer.content_extractor import SPECIAL_CHARACTERS, TextExtractor
+from financial_report_analyzer.http_cache import HTTP_CACHE_DIR, ResponseCache
+from financial_report_analyzer.scraping import SECScraper
+
+
+DEFAULT_URL = "https://www.sec.gov/Archives/edgar/data/320193/000032019323000106/aapl-20230930.htm"
+# Previous sentence pattern, the same lookbehinds in a slower order
+BASELINE_SENTENCE_PATTERN = r"(?<!\w\.\w.)(?<![A-Z][a-z]\.)(?<=\.|\?)\s"
+
+
+def clean_per_sentence(sentence):
+    # Previous implementation, one regex pass per special character and sentence
+    cleaned_sentence = sentence.strip()
+    for char in SPECIAL_CHARACTERS:
+        cleaned_sentence = re.sub(re.escape(char), "", cleaned_sentence)
+    return re.sub(r"\s+", " ", cleaned_sentence)
+
+
+def split_and_clean_per_sentence(text):
+    sentences = re.split(BASELINE_SENTENCE_PATTERN, text)
+    return [clean_per_sentence(sentence) for sentence in sentences if sentence.strip()]
+
+
+def split_and_clean_batch(extractor, text):
+    sentences = extractor.extract_sentences(text)
+    return extractor.clean_batch([sentence for sentence in sentences if sentence.strip()])
+
+
+def load_report(args):
+    if args.path:
+        report = requests.Response()
+        report._content = Path(args.path).read_bytes()
+        report.status_code = 200
+        report.encoding = "utf-8"
+        return report
+    scraper = SECScraper(cache=ResponseCache(args.http_cache, offline=args.offline))
+    return scraper.fetch_report(args.url)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--path", help="Path of a locally saved 10-K HTML file")
+    parser.add_argument("--url", default=DEFAULT_URL, help="10-K URL on EDGAR")
+    parser.add_argument("--http-cache", default=HTTP_CACHE_DIR)
+    parser.add_argument("--offline", action="store_true")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    report = load_report(args)
+    extractor = TextExtractor(report)
+    text = BeautifulSoup(report.text, "html.parser").get_text()
+
+    baseline = split_and_clean_per_sentence(text)
+    batch = split_and_clean_batch(extractor, text)
+    assert batch == baseline, "Batch cleaning changed the extracted sentences"
+
+    baseline_time = min(
+        timeit.repeat(
+            lambda: split_and_clean_per_sentence(text), number=1, repeat=args.repeat
+        )
+    )
+    batch_time = min(
+        timeit.repeat(
+            lambda: split_and_clean_batch(extractor, text), number=1, repeat=args.repeat
+        )
+    )
+
+    print(f"Document: {len(text) / 1e6:.2f}M characters, {len(baseline)} sentences")
+    print(f"Previous split and clean: {baseline_time * 1000:8.1f} ms")
+    print(f"Batch split and clean:    {batch_time * 1000:8.1f} ms")
+    print(f"Speedup:                  {baseline_time / batch_time:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+from financial_report_analyzer.cli import main
+
+
+if __name__ == "__main__":
+    main()
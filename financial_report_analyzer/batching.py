@@ -0,0 +1,46 @@
+MAX_BATCH_TOKENS = 8192
+
+
+def token_budget_batches(lengths: list, max_batch_tokens=MAX_BATCH_TOKENS) -> list:
+    """
+    Group sequence indices into batches of similar length.
+
+    Indices are sorted by length and greedily packed so that the padded size of every
+    batch (rows x longest row) stays within the token budget. A single sequence longer
+    than the budget still gets a batch of its own.
+    :param lengths: Token length of each sequence
+    :param max_batch_tokens: Maximum number of padded tokens per batch
+    :return: List of batches, each a list of indices into lengths
+    """
+
+    order = sorted(range(len(lengths)), key=lengths.__getitem__)
+
+    batches = []
+    batch = []
+    for index in order:
+        # Lengths are ascending, so the current sequence sets the padded width
+        if batch and (len(batch) + 1) * lengths[index] > max_batch_tokens:
+            batches.append(batch)
+            batch = []
+        batch.append(index)
+
+    if batch:
+        batches.append(batch)
+
+    return batches
+
+
+def restore_order(batches: list, batch_results: list, size: int) -> list:
+    """
+    Scatter per-batch results back to the original sequence order.
+    :param batches: Batches of indices as returned by token_budget_batches
+    :param batch_results: One list of results per batch, aligned with its indices
+    :param size: Number of sequences
+    :return: Flat list of results in original order
+    """
+
+    results = [None] * size
+    for batch, batch_result in zip(batches, batch_results):
+        for index, result in zip(batch, batch_result):
+            results[index] = result
+    return results
@@ -0,0 +1,641 @@
+import argparse
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+import pandas as pd
+from loguru import logger
+from tqdm import tqdm
+from financial_report_analyzer.model import BACKENDS
+from financial_report_analyzer.pipeline import FETCH_THREADS, PARSE_PROCESSES
+from financial_report_analyzer.prefilter import MAX_NUMERIC_DENSITY, MIN_WORDS
+from financial_report_analyzer.sentence_store import SENTENCE_STORE_DIR
+from financial_report_analyzer.utils import create_filings_table, load_default_filings
+
+
+DEFAULT_OUTPUT = "scores.csv"
+THREADS_PER_WORKER = 4
+VALIDATION_SAMPLE_SIZE = 2000
+
+# Per process state of the scorer workers, set up once by init_scoring_worker
+WORKER_STATE = {}
+
+
+def create_scraper(http_cache_dir=None, offline=False, requests_per_second=None):
+    from financial_report_analyzer.http_cache import HTTP_CACHE_DIR, ResponseCache
+    from financial_report_analyzer.scraping import SEC_REQUESTS_PER_SECOND, SECScraper
+
+    requests_per_second = requests_per_second or SEC_REQUESTS_PER_SECOND
+    if http_cache_dir is None and not offline:
+        return SECScraper(requests_per_second=requests_per_second)
+    cache = ResponseCache(http_cache_dir or HTTP_CACHE_DIR, offline=offline)
+    return SECScraper(requests_per_second=requests_per_second, cache=cache)
+
+
+def create_sentence_store(sentence_store_dir=None):
+    from financial_report_analyzer.sentence_store import SentenceStore
+
+    return SentenceStore(sentence_store_dir) if sentence_store_dir else None
+
+
+def create_prefilter(
+    prefilter=False, min_words=MIN_WORDS, max_numeric_density=MAX_NUMERIC_DENSITY
+):
+    from financial_report_analyzer.prefilter import SentencePrefilter
+
+    if not prefilter:
+        return None
+    return SentencePrefilter(
+        min_words=min_words, max_numeric_density=max_numeric_density
+    )
+
+
+def init_scoring_worker(
+    threads: int,
+    known_scores: dict,
+    score_cache_path=None,
+    http_cache_dir=None,
+    offline=False,
+    streaming_extraction=False,
+    sentence_store_dir=None,
+    backend="torch",
+    snapshot_dir=None,
+    prefilter=False,
+    requests_per_second=None,
+    min_words=MIN_WORDS,
+    max_numeric_density=MAX_NUMERIC_DENSITY,
+):
+    # Heavy imports happen inside the worker so the parent process stays light
+    import torch
+    from financial_report_analyzer.model import ScoringModel
+    from financial_report_analyzer.pipeline import ReportPipeline
+    from financial_report_analyzer.score_cache import ScoreCache
+
+    # Every worker gets its own slice of the cores instead of all of them
+    torch.set_num_threads(threads)
+    torch.set_num_interop_threads(1)
+
+    cache = ScoreCache(score_cache_path) if score_cache_path else None
+    WORKER_STATE["pipeline"] = ReportPipeline(
+        create_scraper(http_cache_dir, offline, requests_per_second),
+        ScoringModel(
+            cache=cache,
+            backend=backend,
+            snapshot_dir=snapshot_dir,
+            prefilter=create_prefilter(prefilter, min_words, max_numeric_density),
+        ),
+        known_scores=known_scores,
+        streaming_extraction=streaming_extraction,
+        sentence_store=create_sentence_store(sentence_store_dir),
+    )
+
+
+def score_work_item(work_item: tuple) -> dict:
+    ticker, year, url, url_type = work_item
+    try:
+        return WORKER_STATE["pipeline"].score_filing(ticker, year, url, url_type)
+    except Exception as error:
+        return {"ticker": ticker, "year": year, "error": repr(error)}
+
+
+def create_work_items(filings_table: pd.DataFrame, scored=None) -> list:
+    """
+    Build the (ticker, year, url, url_type) work items of all filings that still need scoring.
+    :param filings_table: Filings as returned by create_filings_table
+    :param scored: Optional DF of already scored reports with ticker and year columns
+    :return: List of work items
+    """
+
+    filings_table = filings_table.dropna(subset=["filing_url"])
+    filings_table = filings_table[filings_table["filing_url"] != ""]
+
+    if scored is not None:
+        scored_keys = set(zip(scored["ticker"], scored["year"].astype(str)))
+        filings_table = filings_table[
+            [
+                (ticker, str(year)) not in scored_keys
+                for ticker, year in zip(filings_table["ticker"], filings_table["year"])
+            ]
+        ]
+
+    return [
+        (ticker, year, url, url.rsplit(".", 1)[-1])
+        for ticker, year, url in filings_table[
+            ["ticker", "year", "filing_url"]
+        ].itertuples(index=False)
+    ]
+
+
+def write_scores(report_scores: dict, output: str) -> None:
+    pd.DataFrame([report_scores]).to_csv(
+        output, mode="a", header=not Path(output).exists(), index=False
+    )
+    return None
+
+
+def run_scoring(
+    work_items: list,
+    workers: int,
+    threads: int,
+    output: str,
+    known_scores=None,
+    score_cache_path=None,
+    http_cache_dir=None,
+    offline=False,
+    streaming_extraction=False,
+    sentence_store_dir=None,
+    backend="torch",
+    snapshot_dir=None,
+    prefilter=False,
+    min_words=MIN_WORDS,
+    max_numeric_density=MAX_NUMERIC_DENSITY,
+) -> list:
+    """
+    Score the work items on a pool of scorer processes, each loading the ScoringModel once.
+    :param work_items: List of (ticker, year, url, url_type) tuples
+    :param workers: Number of scorer processes
+    :param threads: Number of torch intra-op threads per process
+    :param output: CSV file the scores are appended to as soon as a report is done
+    :param known_scores: Dict of E/S/G scores keyed by text hash that are reused instead of scored
+    :param score_cache_path: Optional path of a ScoreCache shared by the workers
+    :param http_cache_dir: Optional directory of a ResponseCache shared by the workers
+    :param offline: Only serve reports from the HTTP cache
+    :param streaming_extraction: Extract HTML reports with the streaming parser
+    :param sentence_store_dir: Optional directory of a SentenceStore, stored reports skip fetching and extraction
+    :param backend: Inference backend of the ScoringModel
+    :param snapshot_dir: Optional directory of serialized model snapshots
+    :param prefilter: Label sentences without ESG keywords as none without inference
+    :param min_words: Prefilter threshold, sentences with fewer words are labeled none
+    :param max_numeric_density: Prefilter threshold, sentences with a larger share of digits are labeled none
+    :return: List of the report scores of this run
+    """
+
+    from financial_report_analyzer.scraping import SEC_REQUESTS_PER_SECOND
+
+    session_scores = []
+    # Rate limiters live in one process, so every worker gets its share of the SEC limit
+    requests_per_second = SEC_REQUESTS_PER_SECOND / workers
+    # Spawned workers do not inherit torch thread pools from the parent
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=context,
+        initializer=init_scoring_worker,
+        initargs=(
+            threads,
+            known_scores or {},
+            score_cache_path,
+            http_cache_dir,
+            offline,
+            streaming_extraction,
+            sentence_store_dir,
+            backend,
+            snapshot_dir,
+            prefilter,
+            requests_per_second,
+            min_words,
+            max_numeric_density,
+        ),
+    ) as executor:
+        futures = [executor.submit(score_work_item, item) for item in work_items]
+        for future in tqdm(as_completed(futures), total=len(futures), ncols=60):
+            report_scores = future.result()
+            if "error" in report_scores:
+                logger.warning(
+                    f"Scoring {report_scores['ticker']} {report_scores['year']} failed: {report_scores['error']}"
+                )
+                continue
+            write_scores(report_scores, output)
+            session_scores.append(report_scores)
+
+    return session_scores
+
+
+def run_streaming(
+    work_items: list,
+    threads: int,
+    output: str,
+    fetch_threads: int,
+    parse_processes: int,
+    known_scores=None,
+    score_cache_path=None,
+    http_cache_dir=None,
+    offline=False,
+    streaming_extraction=False,
+    sentence_store_dir=None,
+    backend="torch",
+    snapshot_dir=None,
+    prefilter=False,
+    min_words=MIN_WORDS,
+    max_numeric_density=MAX_NUMERIC_DENSITY,
+) -> list:
+    """
+    Score the work items in this process while downloads and extraction run as background stages.
+    :param work_items: List of (ticker, year, url, url_type) tuples
+    :param threads: Number of torch intra-op threads of the scoring stage
+    :param output: CSV file the scores are appended to as soon as a report is done
+    :param fetch_threads: Number of download threads
+    :param parse_processes: Number of extraction processes
+    :param known_scores: Dict of E/S/G scores keyed by text hash that are reused instead of scored
+    :param score_cache_path: Optional path of a ScoreCache
+    :param http_cache_dir: Optional directory of a ResponseCache
+    :param offline: Only serve reports from the HTTP cache
+    :param streaming_extraction: Extract HTML reports with the streaming parser
+    :param sentence_store_dir: Optional directory of a SentenceStore, stored reports skip fetching and extraction
+    :param backend: Inference backend of the ScoringModel
+    :param snapshot_dir: Optional directory of serialized model snapshots
+    :param prefilter: Label sentences without ESG keywords as none without inference
+    :param min_words: Prefilter threshold, sentences with fewer words are labeled none
+    :param max_numeric_density: Prefilter threshold, sentences with a larger share of digits are labeled none
+    :return: List of the report scores of this run
+    """
+
+    import torch
+    from financial_report_analyzer.model import ScoringModel
+    from financial_report_analyzer.pipeline import StreamingPipeline
+    from financial_report_analyzer.score_cache import ScoreCache
+
+    torch.set_num_threads(threads)
+    cache = ScoreCache(score_cache_path) if score_cache_path else None
+    pipeline = StreamingPipeline(
+        create_scraper(http_cache_dir, offline),
+        ScoringModel(
+            cache=cache,
+            backend=backend,
+            snapshot_dir=snapshot_dir,
+            prefilter=create_prefilter(prefilter, min_words, max_numeric_density),
+        ),
+        known_scores=known_scores,
+        streaming_extraction=streaming_extraction,
+        sentence_store=create_sentence_store(sentence_store_dir),
+        fetch_threads=fetch_threads,
+        parse_processes=parse_processes,
+    )
+
+    session_scores = []
+    for report_scores in tqdm(pipeline.run(work_items), total=len(work_items), ncols=60):
+        if "error" in report_scores:
+            logger.warning(
+                f"Scoring {report_scores['ticker']} {report_scores['year']} failed: {report_scores['error']}"
+            )
+            continue
+        write_scores(report_scores, output)
+        session_scores.append(report_scores)
+
+    return session_scores
+
+
+def run_extraction(
+    work_items: list,
+    sentence_store_dir: str,
+    fetch_threads: int,
+    parse_processes: int,
+    http_cache_dir=None,
+    offline=False,
+    streaming_extraction=False,
+) -> list:
+    """
+    Fetch and extract the work items into the sentence store without scoring them.
+    :param work_items: List of (ticker, year, url, url_type) tuples
+    :param sentence_store_dir: Directory of the SentenceStore
+    :param fetch_threads: Number of download threads
+    :param parse_processes: Number of extraction processes
+    :param http_cache_dir: Optional directory of a ResponseCache
+    :param offline: Only serve reports from the HTTP cache
+    :param streaming_extraction: Extract HTML reports with the streaming parser
+    :return: List of ticker, year and text hash dicts of the extracted reports
+    """
+
+    from financial_report_analyzer.pipeline import StreamingPipeline
+
+    pipeline = StreamingPipeline(
+        create_scraper(http_cache_dir, offline),
+        None,
+        streaming_extraction=streaming_extraction,
+        sentence_store=create_sentence_store(sentence_store_dir),
+        fetch_threads=fetch_threads,
+        parse_processes=parse_processes,
+    )
+
+    extracted = []
+    for report in tqdm(pipeline.extract(work_items), total=len(work_items), ncols=60):
+        if "error" in report:
+            logger.warning(
+                f"Extracting {report['ticker']} {report['year']} failed: {report['error']}"
+            )
+            continue
+        extracted.append(report)
+
+    return extracted
+
+
+def load_work_items(args, scored=None) -> list:
+    filings_table = create_filings_table(load_default_filings(args.filings))
+    if args.tickers:
+        filings_table = filings_table[filings_table["ticker"].isin(args.tickers)]
+    return create_work_items(filings_table, scored)
+
+
+def extract(args) -> None:
+    work_items = load_work_items(args)
+    logger.info(
+        f"Extracting {len(work_items)} filings into {args.sentence_store} with "
+        f"{args.fetch_threads} fetch thread(s) and {args.parse_processes} parse process(es)"
+    )
+    extracted = run_extraction(
+        work_items,
+        sentence_store_dir=args.sentence_store,
+        fetch_threads=args.fetch_threads,
+        parse_processes=args.parse_processes,
+        http_cache_dir=args.http_cache,
+        offline=args.offline,
+        streaming_extraction=args.streaming_extraction,
+    )
+    logger.info(f"Stored the sentences of {len(extracted)} filings")
+    return None
+
+
+def score(args) -> None:
+    known_scores = None
+    scored = None
+    if args.db_path:
+        from financial_report_analyzer.database_conntector import (
+            KEY_COLUMNS,
+            DatabaseConnector,
+        )
+
+        connector = DatabaseConnector(args.db_path)
+        # On a fresh database nothing is scored yet, upsert_data creates the table
+        if args.table in connector.table_names:
+            scored = connector.query_data(
+                args.table,
+                columns=KEY_COLUMNS,
+                filters={"ticker": args.tickers} if args.tickers else None,
+            )
+            known_scores = connector.fetch_hash_scores(args.table)
+
+    work_items = load_work_items(args, scored)
+
+    if args.stream:
+        # The scoring stage gets the cores the extraction processes leave free
+        threads = args.threads or max(1, os.cpu_count() - args.parse_processes)
+        logger.info(
+            f"Streaming {len(work_items)} filings with {args.fetch_threads} fetch thread(s), "
+            f"{args.parse_processes} parse process(es) and {threads} scoring thread(s)"
+        )
+        session_scores = run_streaming(
+            work_items,
+            threads=threads,
+            output=args.output,
+            fetch_threads=args.fetch_threads,
+            parse_processes=args.parse_processes,
+            known_scores=known_scores,
+            score_cache_path=args.score_cache,
+            http_cache_dir=args.http_cache,
+            offline=args.offline,
+            streaming_extraction=args.streaming_extraction,
+            sentence_store_dir=args.sentence_store,
+            backend=args.backend,
+            snapshot_dir=args.model_snapshots,
+            prefilter=args.prefilter,
+            min_words=args.min_words,
+            max_numeric_density=args.max_numeric_density,
+        )
+    else:
+        threads = args.threads or THREADS_PER_WORKER
+        workers = args.workers or max(1, os.cpu_count() // threads)
+        logger.info(
+            f"Scoring {len(work_items)} filings on {workers} worker(s) with {threads} thread(s) each"
+        )
+        session_scores = run_scoring(
+            work_items,
+            workers=workers,
+            threads=threads,
+            output=args.output,
+            known_scores=known_scores,
+            score_cache_path=args.score_cache,
+            http_cache_dir=args.http_cache,
+            offline=args.offline,
+            streaming_extraction=args.streaming_extraction,
+            sentence_store_dir=args.sentence_store,
+            backend=args.backend,
+            snapshot_dir=args.model_snapshots,
+            prefilter=args.prefilter,
+            min_words=args.min_words,
+            max_numeric_density=args.max_numeric_density,
+        )
+
+    if args.db_path and session_scores:
+        # Only the reports of this session are written, existing rows stay untouched
+        connector.upsert_data(pd.DataFrame(session_scores), args.table)
+    return None
+
+
+def add_filing_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--filings",
+        default="filings.json",
+        help="Filings JSON in the defaults directory, mapping ticker -> year -> url",
+    )
+    parser.add_argument("--tickers", nargs="*", help="Only process these tickers")
+    parser.add_argument(
+        "--http-cache", help="Directory of an on-disk cache of the SEC responses"
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="Only read reports from the HTTP cache, never from the network",
+    )
+    parser.add_argument(
+        "--streaming-extraction",
+        action="store_true",
+        help="Parse HTML reports incrementally, skipping tables and hidden iXBRL blocks",
+    )
+    parser.add_argument(
+        "--fetch-threads",
+        type=int,
+        default=FETCH_THREADS,
+        help="Download threads in streaming mode",
+    )
+    parser.add_argument(
+        "--parse-processes",
+        type=int,
+        default=PARSE_PROCESSES,
+        help="Extraction processes in streaming mode",
+    )
+    return None
+
+
+def add_prefilter_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--min-words",
+        type=int,
+        default=MIN_WORDS,
+        help="Sentences with fewer words are filtered",
+    )
+    parser.add_argument(
+        "--max-numeric-density",
+        type=float,
+        default=MAX_NUMERIC_DENSITY,
+        help="Sentences with a larger share of digits are filtered",
+    )
+    return None
+
+
+def validate(args) -> None:
+    import torch
+    from financial_report_analyzer.model import validate_backend
+    from financial_report_analyzer.sentence_store import SentenceStore
+
+    torch.set_num_threads(args.threads)
+    sentences = SentenceStore(args.sentence_store).sample_sentences(
+        args.sample, seed=args.seed
+    )
+    logger.info(
+        f"Validating the {args.backend} backend on {len(sentences)} stored sentences"
+    )
+    report = validate_backend(sentences, args.backend)
+    print(report.to_string(float_format="{:.4f}".format))
+    return None
+
+
+def prefilter_report(args) -> None:
+    import torch
+    from financial_report_analyzer.model import ScoringModel
+    from financial_report_analyzer.prefilter import SentencePrefilter
+    from financial_report_analyzer.sentence_store import SentenceStore
+
+    torch.set_num_threads(args.threads)
+    sentences = SentenceStore(args.sentence_store).sample_sentences(
+        args.sample, seed=args.seed
+    )
+    logger.info(f"Measuring the prefilter on {len(sentences)} stored sentences")
+    labels = ScoringModel(backend=args.backend).classify(sentences)
+    prefilter = SentencePrefilter(
+        min_words=args.min_words, max_numeric_density=args.max_numeric_density
+    )
+    report = prefilter.recall_report(sentences, labels)
+    print(report.to_string(float_format="{:.4f}".format))
+    return None
+
+
+def create_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="financial_report_analyzer")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    score_parser = subparsers.add_parser(
+        "score", help="Fetch, extract and score 10-K filings on a process pool"
+    )
+    add_filing_arguments(score_parser)
+    score_parser.add_argument(
+        "--workers",
+        type=int,
+        help="Number of scorer processes (default: cores / threads), ignored in streaming mode",
+    )
+    score_parser.add_argument(
+        "--threads",
+        type=int,
+        help=f"Torch intra-op threads per scorer process (default: {THREADS_PER_WORKER}, "
+        "in streaming mode the cores left by the parse processes)",
+    )
+    score_parser.add_argument("--output", default=DEFAULT_OUTPUT, help="Output CSV")
+    score_parser.add_argument(
+        "--db-path",
+        help="Database URL; skips scored filings and stores the scores in the table",
+    )
+    score_parser.add_argument("--table", default="scores", help="Scores table")
+    score_parser.add_argument("--score-cache", help="Path of a sentence score cache")
+    score_parser.add_argument(
+        "--sentence-store",
+        help="Directory of extracted sentences; stored filings are scored without fetching",
+    )
+    score_parser.add_argument(
+        "--backend",
+        choices=BACKENDS,
+        default="torch",
+        help="Inference backend: fp32 torch, dynamic int8 quantization or ONNX Runtime",
+    )
+    score_parser.add_argument(
+        "--model-snapshots",
+        help="Directory of serialized models, written on first use to speed up worker startup",
+    )
+    score_parser.add_argument(
+        "--prefilter",
+        action="store_true",
+        help="Label short, numeric and keyword-free sentences as none without inference",
+    )
+    add_prefilter_arguments(score_parser)
+    score_parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Run fetching, extraction and scoring as concurrent pipeline stages",
+    )
+    score_parser.set_defaults(func=score)
+
+    extract_parser = subparsers.add_parser(
+        "extract", help="Fetch and extract 10-K filings into the sentence store"
+    )
+    add_filing_arguments(extract_parser)
+    extract_parser.add_argument(
+        "--sentence-store",
+        default=SENTENCE_STORE_DIR,
+        help="Directory of the extracted sentences",
+    )
+    extract_parser.set_defaults(func=extract)
+
+    validate_parser = subparsers.add_parser(
+        "validate-backend",
+        help="Compare the labels and throughput of a backend with the fp32 models",
+    )
+    validate_parser.add_argument(
+        "--backend", choices=BACKENDS[1:], default="int8", help="Backend to validate"
+    )
+    validate_parser.add_argument(
+        "--sentence-store",
+        default=SENTENCE_STORE_DIR,
+        help="Directory of the extracted sentences the sample is drawn from",
+    )
+    validate_parser.add_argument(
+        "--sample",
+        type=int,
+        default=VALIDATION_SAMPLE_SIZE,
+        help="Number of sampled sentences",
+    )
+    validate_parser.add_argument("--seed", type=int, default=0, help="Sampling seed")
+    validate_parser.add_argument(
+        "--threads", type=int, default=os.cpu_count(), help="Torch intra-op threads"
+    )
+    validate_parser.set_defaults(func=validate)
+
+    prefilter_parser = subparsers.add_parser(
+        "prefilter-report",
+        help="Report the recall of the sentence prefilter against the model labels",
+    )
+    prefilter_parser.add_argument(
+        "--backend", choices=BACKENDS, default="torch", help="Backend of the reference labels"
+    )
+    prefilter_parser.add_argument(
+        "--sentence-store",
+        default=SENTENCE_STORE_DIR,
+        help="Directory of the extracted sentences the sample is drawn from",
+    )
+    prefilter_parser.add_argument(
+        "--sample",
+        type=int,
+        default=VALIDATION_SAMPLE_SIZE,
+        help="Number of sampled sentences",
+    )
+    prefilter_parser.add_argument("--seed", type=int, default=0, help="Sampling seed")
+    prefilter_parser.add_argument(
+        "--threads", type=int, default=os.cpu_count(), help="Torch intra-op threads"
+    )
+    add_prefilter_arguments(prefilter_parser)
+    prefilter_parser.set_defaults(func=prefilter_report)
+
+    return parser
+
+
+def main(argv=None) -> None:
+    args = create_parser().parse_args(argv)
+    args.func(args)
+    return None
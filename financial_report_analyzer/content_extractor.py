@@ -1,29 +1,105 @@
 import hashlib
+import io
+import mmap
+import os
 import re
+from concurrent.futures import ProcessPoolExecutor
 from bs4 import BeautifulSoup
+from lxml import etree
 from pypdf import PdfReader
 
 
 SPECIAL_CHARACTERS = ["\xa0", "☒", "☐", "_"]
-SENTENCE_PATTERN = r"(?<!\w\.\w.)(?<![A-Z][a-z]\.)(?<=\.|\?)\s"
-PDF_CACHE = "cache/report.pdf"
+# The cheap period lookbehind comes first so that most positions fail on a single character
+SENTENCE_PATTERN = r"(?<=\.|\?)(?<!\w\.\w.)(?<![A-Z][a-z]\.)\s"
+SENTENCE_REGEX = re.compile(SENTENCE_PATTERN)
+WHITESPACE_REGEX = re.compile(r"\s+")
+# Joins sentences for batch cleaning, it is neither whitespace nor a special character
+SENTENCE_SEPARATOR = "\x00"
+PDF_PAGES_PER_TASK = 20
+# Elements whose content is never part of the report prose, ix:header holds the hidden iXBRL facts
+SKIPPED_TAGS = {"script", "style", "head", "table", "ix:header"}
+FEED_CHUNK_SIZE = 1 << 20
+
+
+# PDF of the current extraction worker, set once per process by init_pdf_worker
+PDF_WORKER_SOURCE = {}
+
+
+def open_pdf(source) -> PdfReader:
+    """
+    Open a PDF from in-memory bytes or memory map it from a local path.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        return PdfReader(io.BytesIO(source))
+    with open(source, "rb") as f:
+        return PdfReader(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+def extract_pdf_pages(source, start: int, stop: int) -> list:
+    reader = open_pdf(source)
+    return [reader.pages[i].extract_text() for i in range(start, stop)]
+
+
+def init_pdf_worker(source):
+    PDF_WORKER_SOURCE["source"] = source
+
+
+def extract_worker_pdf_pages(start: int, stop: int) -> list:
+    return extract_pdf_pages(PDF_WORKER_SOURCE["source"], start, stop)
+
+
+class StreamingTextTarget:
+    """
+    lxml parser target that collects the visible text of an HTML document without building a tree.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.skip_depth = 0
+
+    def is_skipped(self, tag, attrib) -> bool:
+        style = attrib.get("style", "").replace(" ", "").lower()
+        return tag in SKIPPED_TAGS or "display:none" in style
+
+    def start(self, tag, attrib):
+        if self.skip_depth or self.is_skipped(tag, attrib):
+            self.skip_depth += 1
+
+    def end(self, tag):
+        if self.skip_depth:
+            self.skip_depth -= 1
+
+    def data(self, data):
+        if not self.skip_depth:
+            self.chunks.append(data)
+
+    def close(self):
+        return None
+
+    def pop_chunks(self) -> list:
+        chunks = self.chunks
+        self.chunks = []
+        return chunks
 
 
 class TextExtractor:
-    def __init__(self, report):
+    def __init__(self, report, pdf_processes=None):
+        # A requests response, or the path of a local PDF report
         self.report = report
+        # Processes extracting PDF page ranges in parallel, defaults to all cores
+        self.pdf_processes = pdf_processes or os.cpu_count()
 
     def remove_special_characters(self, text):
         for char in SPECIAL_CHARACTERS:
-            char = re.escape(char)
-            text = re.sub(char, "", text)
+            text = text.replace(char, "")
         return text
 
     def reduce_multiple_spaces(self, text):
-        return re.sub(r"\s+", " ", text)
+        return WHITESPACE_REGEX.sub(" ", text)
 
     def extract_sentences(self, text):
-        return re.split(SENTENCE_PATTERN, text)
+        return SENTENCE_REGEX.split(text)
 
     def clean(self, sentence):
         cleaned_sentences = sentence.strip()
@@ -31,37 +107,111 @@ class TextExtractor:
         cleaned_sentences = self.reduce_multiple_spaces(cleaned_sentences)
         return cleaned_sentences
 
-    def extract_text_from_pdf(self):
-        reader = PdfReader(self.report)
-        texts = []
-        for page in reader.pages:
-            texts.append(page.extract_text())
-        return "".join(texts)
+    def clean_batch(self, sentences: list) -> list:
+        """
+        Clean many sentences at once, with the same result as clean on each sentence. The
+        stripped sentences are joined into one text so that special characters and whitespace
+        are normalized in a single pass each.
+        """
+        if not sentences:
+            return []
+        stripped = [sentence.strip() for sentence in sentences]
+        # Outer separators keep the whitespace at the ends of the first and last sentence
+        text = SENTENCE_SEPARATOR + SENTENCE_SEPARATOR.join(stripped) + SENTENCE_SEPARATOR
+        if text.count(SENTENCE_SEPARATOR) != len(stripped) + 1:
+            return [self.clean(sentence) for sentence in sentences]
+        text = self.remove_special_characters(text)
+        # Same as reduce_multiple_spaces, str.split collapses whitespace without regex overhead
+        text = " ".join(text.split())
+        return text.split(SENTENCE_SEPARATOR)[1:-1]
+
+    def get_pdf_source(self):
+        # Downloaded reports stay in memory, local reports are memory mapped from disk
+        if isinstance(self.report, (str, os.PathLike)):
+            return os.fspath(self.report)
+        return self.report.content
+
+    def iter_pdf_pages(self, pages_per_task=PDF_PAGES_PER_TASK):
+        """
+        Extract the page texts of the PDF report in order, splitting the pages into ranges
+        that are extracted in parallel on a process pool.
+        """
+        source = self.get_pdf_source()
+        page_count = len(open_pdf(source).pages)
+        page_ranges = [
+            (start, min(start + pages_per_task, page_count))
+            for start in range(0, page_count, pages_per_task)
+        ]
 
-    def store_pdf_cache(self):
-        with open(PDF_CACHE, "wb") as f:
-            f.write(self.report.content)
+        if self.pdf_processes == 1 or len(page_ranges) <= 1:
+            for start, stop in page_ranges:
+                yield from extract_pdf_pages(source, start, stop)
+            return
+
+        # Every worker receives the PDF once instead of once per page range
+        with ProcessPoolExecutor(
+            max_workers=min(self.pdf_processes, len(page_ranges)),
+            initializer=init_pdf_worker,
+            initargs=(source,),
+        ) as executor:
+            futures = [
+                executor.submit(extract_worker_pdf_pages, start, stop)
+                for start, stop in page_ranges
+            ]
+            for future in futures:
+                yield from future.result()
+
+    def extract_text_from_pdf(self):
+        return "".join(self.iter_pdf_pages())
 
     def create_hash(self, texts: list):
         raw_text = "".join(texts)
         return hashlib.sha256(raw_text.encode()).hexdigest()
 
-    def get_sentences(self, url_type="htm"):
+    def iter_text(self, chunk_size=FEED_CHUNK_SIZE):
+        """
+        Incrementally parse the HTML report and yield its visible text as it goes.
+        Scripts, styles, tables, hidden iXBRL blocks and display:none elements are skipped.
+        """
+        target = StreamingTextTarget()
+        parser = etree.HTMLParser(target=target, encoding=self.report.encoding)
+        content = self.report.content
+        for start in range(0, len(content), chunk_size):
+            parser.feed(content[start : start + chunk_size])
+            yield "".join(target.pop_chunks())
+        parser.close()
+        yield "".join(target.pop_chunks())
+
+    def iter_sentences(self, texts=None):
+        """
+        Split streamed text into cleaned sentences, holding back the last, possibly
+        incomplete sentence of each chunk until the next chunk arrives.
+        :param texts: Iterable of text chunks, defaults to the streamed HTML text of the report
+        """
+        remainder = ""
+        for text in texts if texts is not None else self.iter_text():
+            sentences = self.extract_sentences(remainder + text)
+            remainder = sentences.pop()
+            yield from self.clean_batch(
+                [sentence for sentence in sentences if sentence.strip()]
+            )
+        if remainder.strip():
+            yield self.clean(remainder)
+
+    def get_sentences(self, url_type="htm", streaming=False):
+        if streaming and url_type != "pdf":
+            return list(self.iter_sentences())
         if url_type == "pdf":
-            self.store_pdf_cache()
             texts = self.extract_text_from_pdf()
         else:
             texts = self.report.text
         soup = BeautifulSoup(texts, "html.parser")
         text = soup.get_text()
         sentences = self.extract_sentences(text)
-        return [self.clean(sentence) for sentence in sentences if sentence.strip()]
+        return self.clean_batch([sentence for sentence in sentences if sentence.strip()])
+
+    def iter_scentences_dax(self):
+        return self.iter_sentences(self.iter_pdf_pages())
 
     def get_scentences_dax(self):
-        reader = PdfReader(self.report)
-        texts = []
-        for page in reader.pages:
-            texts.append(page.extract_text())
-        text = "".join(texts)
-        sentences = self.extract_sentences(text)
-        return [self.clean(sentence) for sentence in sentences if sentence.strip()]
+        return list(self.iter_scentences_dax())
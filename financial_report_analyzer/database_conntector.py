@@ -1,32 +1,360 @@
+import csv
+import io
+import os
+import threading
+from functools import cached_property
 import pandas as pd
-from sqlalchemy import create_engine
+from sqlalchemy import (
+    MetaData,
+    Table,
+    and_,
+    create_engine,
+    exists,
+    func,
+    inspect,
+    select,
+    text,
+)
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError
 
 
 DB_PASSWORD = "your_password"
 DB_PATH = f"postgresql:{DB_PASSWORD}@localhost:5432/esg"
 DEFAULT_TABLE = "scores"
+SCORE_COLUMNS = ["environmental", "social", "governance"]
+# A report is identified by its ticker and fiscal year, upserts replace rows with the same key
+KEY_COLUMNS = ["ticker", "year"]
+POOL_SIZE = 5
+MAX_OVERFLOW = 10
+# Seconds after which pooled connections are replaced, before servers drop idle ones
+POOL_RECYCLE = 1800
+# Upsert statements per backend, DuckDB understands the PostgreSQL ON CONFLICT syntax
+UPSERT_INSERTS = {
+    "postgresql": postgresql.insert,
+    "duckdb": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+EMBEDDED_BACKENDS = ["sqlite", "duckdb"]
+
+# One engine, and so one connection pool, per database URL and process
+ENGINES = {}
+ENGINE_LOCK = threading.Lock()
+
+
+def create_pooled_engine(db_path: str):
+    url = make_url(db_path)
+    if url.get_backend_name() in EMBEDDED_BACKENDS:
+        # Local database files, e.g. sqlite:///scores.db or duckdb:///scores.duckdb (needs duckdb_engine)
+        connect_args = {"timeout": 60} if url.get_backend_name() == "sqlite" else {}
+        return create_engine(url, connect_args=connect_args)
+    return create_engine(
+        url,
+        pool_size=POOL_SIZE,
+        max_overflow=MAX_OVERFLOW,
+        pool_recycle=POOL_RECYCLE,
+        pool_pre_ping=True,
+    )
+
+
+def get_engine(db_path: str):
+    """
+    Shared engine of a database URL. Engines connect lazily on their first query.
+    """
+    with ENGINE_LOCK:
+        if db_path not in ENGINES:
+            ENGINES[db_path] = create_pooled_engine(db_path)
+        return ENGINES[db_path]
+
+
+def reset_engines_after_fork() -> None:
+    global ENGINE_LOCK
+    ENGINE_LOCK = threading.Lock()
+    # Pooled connections of the parent must not be used, nor closed, by a forked child
+    for engine in ENGINES.values():
+        engine.dispose(close=False)
+    return None
+
+
+os.register_at_fork(after_in_child=reset_engines_after_fork)
+
+
+def copy_csv(connection, name: str, columns: list, buffer) -> int:
+    """
+    Bulk load CSV rows into a table with PostgreSQL COPY, empty fields become NULL.
+    :param connection: SQLAlchemy connection
+    :param name: Quoted table name
+    :param columns: Column names in the order of the CSV fields
+    :param buffer: File-like object holding the CSV rows without header
+    :return: Number of copied rows
+    """
+    preparer = connection.dialect.identifier_preparer
+    column_list = ", ".join(preparer.quote(column) for column in columns)
+    with connection.connection.cursor() as cursor:
+        cursor.copy_expert(f"COPY {name} ({column_list}) FROM STDIN WITH CSV", buffer)
+        return cursor.rowcount
+
+
+def copy_insert(table, connection, keys, data_iter) -> int:
+    """
+    pandas.to_sql insertion method that loads the rows with COPY instead of INSERT batches.
+    """
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(data_iter)
+    buffer.seek(0)
+
+    preparer = connection.dialect.identifier_preparer
+    name = preparer.quote(table.name)
+    if table.schema:
+        name = f"{preparer.quote(table.schema)}.{name}"
+    return copy_csv(connection, name, keys, buffer)
 
 
 class DatabaseConnector:
     def __init__(
         self, db_path=DB_PATH, db_password=DB_PASSWORD, default_table=DEFAULT_TABLE
     ):
-        self.engine = create_engine(db_path)
-        self.table_names = (
-            pd.read_sql(
-                """
-            SELECT table_name
-            FROM information_schema.tables
-            WHERE table_schema = 'public'
-            """,
-                self.engine,
-            ),
-        )
+        self.engine = get_engine(db_path)
         self.default_table = default_table
+        # Reflected tables, loaded on first use
+        self.metadata = MetaData()
+
+    @cached_property
+    def table_names(self) -> list:
+        return inspect(self.engine).get_table_names()
+
+    @property
+    def supports_copy(self) -> bool:
+        return self.engine.dialect.driver == "psycopg2"
+
+    def forget_table(self, table: str) -> None:
+        # Drop cached metadata after this connector changed the schema
+        if table in self.metadata.tables:
+            self.metadata.remove(self.metadata.tables[table])
+        self.__dict__.pop("table_names", None)
+        return None
 
     def fetch_data(self, table=DEFAULT_TABLE) -> pd.DataFrame:
         return pd.read_sql_table(table, self.engine)
 
+    def get_table(self, table: str) -> Table:
+        if table not in self.metadata.tables:
+            Table(table, self.metadata, autoload_with=self.engine)
+        return self.metadata.tables[table]
+
+    def create_query(
+        self,
+        table: str,
+        columns=None,
+        filters=None,
+        exclude=None,
+        exclude_on=KEY_COLUMNS,
+        unique_on=None,
+        order_by=None,
+    ):
+        source = self.get_table(table)
+        selected = [source.c[column] for column in columns] if columns else list(source.c)
+
+        conditions = []
+        for column, value in (filters or {}).items():
+            if isinstance(value, (list, tuple, set)):
+                conditions.append(source.c[column].in_(list(value)))
+            else:
+                conditions.append(source.c[column] == value)
+        if exclude is not None:
+            excluded = self.get_table(exclude)
+            conditions.append(
+                ~exists().where(
+                    and_(*[excluded.c[column] == source.c[column] for column in exclude_on])
+                )
+            )
+
+        order = [source.c[column] for column in order_by or []]
+        if unique_on is None:
+            return select(*selected).where(*conditions).order_by(*order)
+
+        if not order:
+            # SQL tables have no row order, without order_by the kept row would be arbitrary
+            raise ValueError("unique_on needs order_by to choose the row kept per key")
+
+        # Keep the row of every key that comes first in order_by order
+        rank = (
+            func.row_number()
+            .over(
+                partition_by=[source.c[column] for column in unique_on],
+                order_by=order,
+            )
+            .label("row_rank")
+        )
+        ranked = select(*selected, rank).where(*conditions).subquery()
+        return (
+            select(*[ranked.c[column.name] for column in selected])
+            .where(ranked.c.row_rank == 1)
+            .order_by(*[ranked.c[column.name] for column in order if column.name in ranked.c])
+        )
+
+    def iter_query(self, query, chunksize: int):
+        # Server side cursor, only one chunk of rows is held in memory at a time
+        with self.engine.connect().execution_options(stream_results=True) as connection:
+            yield from pd.read_sql(query, connection, chunksize=chunksize)
+
+    def query_data(
+        self,
+        table=DEFAULT_TABLE,
+        columns=None,
+        filters=None,
+        exclude=None,
+        exclude_on=KEY_COLUMNS,
+        unique_on=None,
+        order_by=None,
+        chunksize=None,
+    ):
+        """
+        Read a slice of a table, with the projection, filters and deduplication done in SQL.
+        :param table: Table to read
+        :param columns: Columns to select, defaults to all columns
+        :param filters: Dict of column -> value, or list of values, that rows must match
+        :param exclude: Table whose keys are excluded, e.g. the scores table when reading filings
+        :param exclude_on: Columns of the anti-join with the exclude table
+        :param unique_on: Columns of which one row per value is kept, requires order_by
+        :param order_by: Columns ordering the result, the first row of every unique_on group in
+                         this order is kept, so they should make the order of the rows unique
+        :param chunksize: Return an iterator of DFs with this many rows each instead of one DF
+        :return: DF, or iterator of DFs if chunksize is set
+        """
+
+        query = self.create_query(
+            table, columns, filters, exclude, exclude_on, unique_on, order_by
+        )
+        if chunksize is None:
+            return pd.read_sql(query, self.engine)
+        return self.iter_query(query, chunksize)
+
     def store_data(self, df, table=DEFAULT_TABLE) -> None:
         df.to_sql(table, self.engine, if_exists="replace", index=False, chunksize=100)
+        self.forget_table(table)
+        return None
+
+    def append_data(self, df, table=DEFAULT_TABLE) -> None:
+        """
+        Append the rows to the table with COPY, creating the table if it does not exist.
+        """
+        method = copy_insert if self.supports_copy else None
+        df.to_sql(table, self.engine, if_exists="append", index=False, method=method)
+        self.forget_table(table)
         return None
+
+    def quote(self, name: str) -> str:
+        return self.engine.dialect.identifier_preparer.quote(name)
+
+    def create_key_index(self, connection, table: str, key_columns: list) -> None:
+        # ON CONFLICT needs a unique index on exactly the key columns
+        index = self.quote(f"{table}_{'_'.join(key_columns)}_key")
+        columns = ", ".join(self.quote(column) for column in key_columns)
+        try:
+            connection.execute(
+                text(
+                    f"CREATE UNIQUE INDEX IF NOT EXISTS {index} ON {self.quote(table)} ({columns})"
+                )
+            )
+        except IntegrityError as error:
+            raise ValueError(
+                f"Table {table} has duplicate {key_columns} rows, remove them before upserting"
+            ) from error
+        return None
+
+    def merge_staged(self, connection, df, table: str, key_columns: list) -> None:
+        # PostgreSQL: COPY into a temporary staging table, then one set based merge
+        stage = f"{table}_stage"
+        columns = ", ".join(self.quote(column) for column in df.columns)
+        keys = ", ".join(self.quote(column) for column in key_columns)
+        updates = ", ".join(
+            f"{self.quote(column)} = EXCLUDED.{self.quote(column)}"
+            for column in df.columns
+            if column not in key_columns
+        )
+        conflict_action = f"DO UPDATE SET {updates}" if updates else "DO NOTHING"
+
+        connection.execute(
+            text(
+                f"CREATE TEMPORARY TABLE {self.quote(stage)} "
+                f"(LIKE {self.quote(table)} INCLUDING DEFAULTS) ON COMMIT DROP"
+            )
+        )
+        buffer = io.StringIO()
+        df.to_csv(buffer, index=False, header=False)
+        buffer.seek(0)
+        copy_csv(connection, self.quote(stage), list(df.columns), buffer)
+        connection.execute(
+            text(
+                f"INSERT INTO {self.quote(table)} ({columns}) "
+                f"SELECT {columns} FROM {self.quote(stage)} "
+                f"ON CONFLICT ({keys}) {conflict_action}"
+            )
+        )
+        return None
+
+    def merge_rows(self, connection, df, table: str, key_columns: list) -> None:
+        # Other backends: batched INSERT ... ON CONFLICT in the dialect's own syntax
+        backend = self.engine.dialect.name
+        if backend not in UPSERT_INSERTS:
+            raise ValueError(f"Upserts are not supported on {backend}")
+
+        target = self.get_table(table)
+        statement = UPSERT_INSERTS[backend](target)
+        updates = {
+            column: statement.excluded[column]
+            for column in df.columns
+            if column not in key_columns
+        }
+        index_elements = [target.c[column] for column in key_columns]
+        if updates:
+            statement = statement.on_conflict_do_update(
+                index_elements=index_elements, set_=updates
+            )
+        else:
+            statement = statement.on_conflict_do_nothing(index_elements=index_elements)
+
+        records = df.astype(object).where(df.notna(), None).to_dict("records")
+        connection.execute(statement, records)
+        return None
+
+    def upsert_data(self, df, table=DEFAULT_TABLE, key_columns=KEY_COLUMNS) -> None:
+        """
+        Insert new rows and update existing rows with the same key, in time proportional to
+        the number of rows written rather than to the size of the table.
+
+        On PostgreSQL the rows are copied into a temporary staging table and merged with
+        INSERT ... ON CONFLICT DO UPDATE, other backends run the INSERT ... ON CONFLICT
+        statement on the rows directly. Either way everything happens in one transaction.
+        :param df: DF with the columns of the table
+        :param table: Target table, created from df if it does not exist
+        :param key_columns: Columns identifying a row
+        """
+
+        if df.empty:
+            return None
+        df = df.drop_duplicates(subset=key_columns, keep="last")
+        if not inspect(self.engine).has_table(table):
+            self.append_data(df, table)
+            with self.engine.begin() as connection:
+                self.create_key_index(connection, table, key_columns)
+            return None
+
+        merge = self.merge_staged if self.supports_copy else self.merge_rows
+        with self.engine.begin() as connection:
+            self.create_key_index(connection, table, key_columns)
+            merge(connection, df, table, key_columns)
+        return None
+
+    def fetch_hash_scores(self, table=DEFAULT_TABLE) -> dict:
+        # A fresh database has no scores table yet and so no known hashes
+        if table not in self.table_names:
+            return {}
+        scores = (
+            self.query_data(table, columns=["text_hash", *SCORE_COLUMNS])
+            .dropna(subset=["text_hash"])
+            .drop_duplicates(subset="text_hash", keep="last")
+        )
+        return scores.set_index("text_hash")[SCORE_COLUMNS].to_dict("index")
@@ -0,0 +1,122 @@
+import gzip
+import hashlib
+import json
+import time
+from pathlib import Path
+import requests
+from requests.structures import CaseInsensitiveDict
+from financial_report_analyzer.utils import atomic_path
+
+
+HTTP_CACHE_DIR = "cache/http"
+# Filed documents on EDGAR never change, so their cached copies are never revalidated
+IMMUTABLE_PREFIXES = ("https://www.sec.gov/Archives/",)
+# Headers that describe the transfer rather than the stored, already decoded body
+TRANSFER_HEADERS = ["content-encoding", "content-length", "transfer-encoding"]
+
+
+class ResponseCache:
+    """
+    On disk cache of HTTP responses keyed by URL with gzip compressed bodies.
+
+    Cached responses of mutable pages are revalidated with ETag / Last-Modified requests,
+    immutable EDGAR archive documents are served straight from disk. In offline mode the
+    network is never used and a missing entry raises a FileNotFoundError, which also allows
+    running against a local fixture directory.
+
+    :param directory: Directory holding the cached responses
+    :param offline: Only serve responses from the cache
+    """
+
+    def __init__(self, directory=HTTP_CACHE_DIR, offline=False):
+        self.directory = Path(directory)
+        self.offline = offline
+
+    def create_url(self, url: str, params=None) -> str:
+        return requests.Request("GET", url, params=params).prepare().url
+
+    def create_paths(self, url: str) -> tuple:
+        key = hashlib.sha256(url.encode()).hexdigest()
+        directory = self.directory / key[:2]
+        return directory / f"{key}.gz", directory / f"{key}.json"
+
+    def is_immutable(self, url: str) -> bool:
+        return url.startswith(IMMUTABLE_PREFIXES)
+
+    def load(self, url: str):
+        body_path, metadata_path = self.create_paths(url)
+        if not (body_path.exists() and metadata_path.exists()):
+            return None
+
+        with open(metadata_path, "r") as f:
+            metadata = json.load(f)
+        with gzip.open(body_path, "rb") as f:
+            body = f.read()
+
+        response = requests.Response()
+        response._content = body
+        response.status_code = metadata["status_code"]
+        response.headers = CaseInsensitiveDict(metadata["headers"])
+        response.encoding = metadata["encoding"]
+        response.url = url
+        return response
+
+    def write_atomic(self, path: Path, data: bytes) -> None:
+        # Concurrent workers must never see a half written entry
+        with atomic_path(path) as temporary_path:
+            with open(temporary_path, "wb") as f:
+                f.write(data)
+        return None
+
+    def store(self, url: str, response: requests.Response) -> None:
+        body_path, metadata_path = self.create_paths(url)
+        body_path.parent.mkdir(parents=True, exist_ok=True)
+
+        headers = {
+            name: value
+            for name, value in response.headers.items()
+            if name.lower() not in TRANSFER_HEADERS
+        }
+        metadata = {
+            "url": url,
+            "status_code": response.status_code,
+            "headers": headers,
+            "encoding": response.encoding,
+            "stored": time.time(),
+        }
+        self.write_atomic(body_path, gzip.compress(response.content))
+        self.write_atomic(metadata_path, json.dumps(metadata).encode())
+        return None
+
+    def fetch(self, url: str, params, request) -> requests.Response:
+        """
+        Serve a GET request from the cache, revalidating or downloading it where needed.
+        :param url: Requested URL
+        :param params: Query parameters of the request
+        :param request: Callable (url, params, headers) -> response that hits the network
+        :return: Response object
+        """
+
+        full_url = self.create_url(url, params)
+        cached = self.load(full_url)
+
+        if cached is not None and (self.offline or self.is_immutable(full_url)):
+            return cached
+        if self.offline:
+            raise FileNotFoundError(
+                f"{full_url} is not in the HTTP cache {self.directory} and offline mode is enabled"
+            )
+
+        headers = {}
+        if cached is not None:
+            if "ETag" in cached.headers:
+                headers["If-None-Match"] = cached.headers["ETag"]
+            if "Last-Modified" in cached.headers:
+                headers["If-Modified-Since"] = cached.headers["Last-Modified"]
+
+        response = request(url, params, headers)
+        if response.status_code == 304 and cached is not None:
+            return cached
+        if response.ok:
+            self.store(full_url, response)
+        return response
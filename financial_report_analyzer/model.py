@@ -1,7 +1,14 @@
+import time
+from pathlib import Path
 import numpy as np
 import pandas as pd
 from tqdm import tqdm
-from transformers import AutoModelForSequenceClassification, AutoTokenizer, pipeline
+from financial_report_analyzer.batching import (
+    MAX_BATCH_TOKENS,
+    restore_order,
+    token_budget_batches,
+)
+from financial_report_analyzer.utils import atomic_path
 
 
 MODEL_TYPES = {
@@ -9,33 +16,292 @@ MODEL_TYPES = {
     "social": "ESGBERT/SocialBERT-social",
     "governance": "ESGBERT/GovernanceBERT-governance",
 }
+NONE_LABEL = "none"
+# "torch" runs the fp32 models, "int8" dynamically quantizes their linear layers and
+# "onnx" runs exported graphs on ONNX Runtime (requires optimum[onnxruntime])
+BACKENDS = ["torch", "int8", "onnx"]
+DEFAULT_BACKEND = "torch"
 
 
 class ScoringModel:
-    def __init__(self):
-        env_pipe = self.load_pipe("environmental")
-        soc_pipe = self.load_pipe("social")
-        gov_pipe = self.load_pipe("governance")
-        self.pipes = {
-            "environmental": env_pipe,
-            "social": soc_pipe,
-            "governance": gov_pipe,
-        }
+    """
+    ESGBERT classifiers of the environmental, social and governance dimensions.
+
+    Models are loaded on first use and only for the requested dimensions, torch and
+    transformers are imported at that point as well. With a snapshot directory, every
+    loaded model is serialized once and later instances, e.g. new workers, load the
+    snapshot instead of building the model from the hub checkpoint again.
+
+    :param max_batch_tokens: Token budget of the inference batches
+    :param cache: Optional ScoreCache, inference only runs on sentences missing from it
+    :param backend: Inference backend, one of BACKENDS
+    :param dimensions: Dimensions to score, defaults to all of MODEL_TYPES
+    :param snapshot_dir: Optional directory of serialized model snapshots
+    :param prefilter: Optional SentencePrefilter, sentences it rejects are labeled none without inference
+    """
+
+    def __init__(
+        self,
+        max_batch_tokens=MAX_BATCH_TOKENS,
+        cache=None,
+        backend=DEFAULT_BACKEND,
+        dimensions=None,
+        snapshot_dir=None,
+        prefilter=None,
+    ):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend {backend}, choose one of {BACKENDS}")
+        self.dimensions = list(dimensions or MODEL_TYPES)
+        unknown = set(self.dimensions) - set(MODEL_TYPES)
+        if unknown:
+            raise ValueError(f"Unknown dimensions {sorted(unknown)}")
+        self.max_batch_tokens = max_batch_tokens
+        self.cache = cache
+        self.backend = backend
+        self.snapshot_dir = Path(snapshot_dir) if snapshot_dir else None
+        self.prefilter = prefilter
+        self.models = {}
+        # Classifiers sharing a vocabulary are grouped behind a single tokenizer,
+        # so every sentence is tokenized once per group instead of once per model
+        self.encoders = []
+
+    def load(self):
+        for dimension in self.dimensions:
+            if dimension not in self.models:
+                tokenizer, model = self.load_model(dimension)
+                self.models[dimension] = model
+                self.add_encoder(dimension, tokenizer)
+        return self
+
+    def load_model(self, dimension):
+        if self.snapshot_dir is None:
+            return self.build_model(MODEL_TYPES[dimension])
+        if self.backend == "onnx":
+            return self.load_onnx_snapshot(dimension)
+        return self.load_snapshot(dimension)
+
+    def build_model(self, name):
+        from transformers import AutoModelForSequenceClassification, AutoTokenizer
 
-    def load_pipe(self, type):
-        name = MODEL_TYPES[type]
         tokenizer = AutoTokenizer.from_pretrained(name)
+        if self.backend == "onnx":
+            from optimum.onnxruntime import ORTModelForSequenceClassification
+
+            # Snapshot directories already hold the exported graph
+            export = not (Path(name) / "model.onnx").exists()
+            model = ORTModelForSequenceClassification.from_pretrained(name, export=export)
+            return tokenizer, model
+
         model = AutoModelForSequenceClassification.from_pretrained(name)
-        return pipeline("text-classification", model=model, tokenizer=tokenizer)
+        model.eval()
+        if self.backend == "int8":
+            import torch
 
-    def calculate_report_scores(self, sentences: list) -> dict:
+            model = torch.quantization.quantize_dynamic(
+                model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+        return tokenizer, model
+
+    def create_snapshot_path(self, dimension) -> Path:
+        suffix = "" if self.backend == "onnx" else ".pt"
+        return self.snapshot_dir / f"{dimension}-{self.backend}{suffix}"
+
+    def load_snapshot(self, dimension):
+        import torch
+
+        path = self.create_snapshot_path(dimension)
+        if path.exists():
+            # Snapshots are pickled models written by this class, not untrusted checkpoints
+            return torch.load(path, weights_only=False)
+
+        tokenizer, model = self.build_model(MODEL_TYPES[dimension])
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Workers starting at the same time each write their own copy
+        with atomic_path(path) as temporary_path:
+            torch.save((tokenizer, model), temporary_path)
+        return tokenizer, model
+
+    def load_onnx_snapshot(self, dimension):
+        # ONNX Runtime sessions cannot be pickled, the exported graph is saved instead
+        path = self.create_snapshot_path(dimension)
+        if path.exists():
+            return self.build_model(str(path))
+
+        tokenizer, model = self.build_model(MODEL_TYPES[dimension])
+        try:
+            with atomic_path(path) as temporary_path:
+                tokenizer.save_pretrained(temporary_path)
+                model.save_pretrained(temporary_path)
+        except OSError:
+            # Another worker stored the snapshot first, its copy is kept and ours was removed
+            if not path.exists():
+                raise
+        return tokenizer, model
+
+    def create_model_name(self, dimension) -> str:
+        # Labels of different backends may differ slightly and are cached separately
+        name = MODEL_TYPES[dimension]
+        return name if self.backend == DEFAULT_BACKEND else f"{name}:{self.backend}"
+
+    def add_encoder(self, dimension, tokenizer):
+        vocab = tokenizer.get_vocab()
+        for encoder in self.encoders:
+            if (
+                type(encoder["tokenizer"]) is type(tokenizer)
+                and encoder["vocab"] == vocab
+            ):
+                encoder["dimensions"].append(dimension)
+                return
+        self.encoders.append(
+            {"tokenizer": tokenizer, "vocab": vocab, "dimensions": [dimension]}
+        )
+
+    def predict_labels(self, model, tokens) -> list:
+        logits = model(**tokens).logits
+        return [model.config.id2label[i] for i in logits.argmax(dim=-1).tolist()]
+
+    def predict(self, encoder, sentences: list) -> dict:
+        import torch
+
+        tokenizer = encoder["tokenizer"]
+        if not sentences:
+            return {dimension: [] for dimension in encoder["dimensions"]}
+
+        # Tokenize without padding once, then pad each length bucket on its own
+        encodings = tokenizer(sentences, truncation=True)
+        lengths = [len(input_ids) for input_ids in encodings["input_ids"]]
+        batches = token_budget_batches(lengths, self.max_batch_tokens)
+
+        batch_labels = {dimension: [] for dimension in encoder["dimensions"]}
+        for batch in tqdm(batches, ncols=60):
+            tokens = tokenizer.pad(
+                {key: [encodings[key][i] for i in batch] for key in encodings},
+                return_tensors="pt",
+            )
+            with torch.inference_mode():
+                for dimension in encoder["dimensions"]:
+                    batch_labels[dimension].append(
+                        self.predict_labels(self.models[dimension], tokens)
+                    )
+
+        return {
+            dimension: restore_order(batches, results, len(sentences))
+            for dimension, results in batch_labels.items()
+        }
+
+    def lookup_cache(self, sentences: list, dimension) -> list:
+        if self.cache is None:
+            return [None] * len(sentences)
+        return self.cache.get_labels(sentences, self.create_model_name(dimension))
+
+    def classify(self, sentences: list) -> dict:
+        if self.prefilter is None:
+            return self.run_classifiers(sentences)
+
+        # Filtered sentences are labeled none without running or caching any model
+        kept = self.prefilter.keep(sentences)
+        kept_labels = self.run_classifiers(
+            [sentence for sentence, keep in zip(sentences, kept) if keep]
+        )
+        labels = {}
+        for dimension, dimension_labels in kept_labels.items():
+            remaining = iter(dimension_labels)
+            labels[dimension] = [next(remaining) if keep else NONE_LABEL for keep in kept]
+        return labels
+
+    def run_classifiers(self, sentences: list) -> dict:
+        self.load()
+        labels = {}
+
+        for encoder in self.encoders:
+            dimensions = encoder["dimensions"]
+            cached = {
+                dimension: self.lookup_cache(sentences, dimension)
+                for dimension in dimensions
+            }
+            # Unique sentences that miss the cache for at least one classifier
+            pending = list(
+                dict.fromkeys(
+                    sentence
+                    for i, sentence in enumerate(sentences)
+                    if any(cached[dimension][i] is None for dimension in dimensions)
+                )
+            )
+            predicted = self.predict(encoder, pending)
+
+            for dimension in dimensions:
+                if self.cache is not None:
+                    self.cache.store_labels(
+                        pending, predicted[dimension], self.create_model_name(dimension)
+                    )
+                predicted_labels = dict(zip(pending, predicted[dimension]))
+                labels[dimension] = [
+                    label if label is not None else predicted_labels[sentence]
+                    for sentence, label in zip(sentences, cached[dimension])
+                ]
+
+        return {dimension: labels[dimension] for dimension in self.dimensions}
+
+    def calculate_batch_scores(self, reports: list) -> list:
+        """
+        Score several reports with a single classification pass over all of their sentences.
+        :param reports: List of sentence lists, one per report
+        :return: List of score dicts aligned with reports
+        """
         pd.set_option("future.no_silent_downcasting", True)
 
-        pipe_results = {}
+        sentences = [sentence for report in reports for sentence in report]
+        labels = pd.DataFrame(self.classify(sentences)).replace(NONE_LABEL, np.nan)
+        flags = (~labels.isna()).astype(int)
+
+        report_scores = []
+        start = 0
+        for report in reports:
+            report_flags = flags.iloc[start : start + len(report)]
+            report_scores.append(report_flags.mean().to_dict())
+            start += len(report)
+        return report_scores
+
+    def calculate_report_scores(self, sentences: list) -> dict:
+        return self.calculate_batch_scores([sentences])[0]
+
+
+def validate_backend(
+    sentences: list, backend: str, max_batch_tokens=MAX_BATCH_TOKENS
+) -> pd.DataFrame:
+    """
+    Compare the labels and throughput of a backend against the fp32 torch models.
+    :param sentences: Sample of cleaned sentences, e.g. from a SentenceStore
+    :param backend: Backend to validate, one of BACKENDS
+    :param max_batch_tokens: Token budget of the inference batches
+    :return: DF with the label agreement, positive rates and sentences per second per dimension
+    """
 
-        for pipe in tqdm(self.pipes, ncols=60):
-            result = self.pipes[pipe](sentences, padding=True, truncation=True)
-            pipe_results[pipe] = pd.DataFrame(result)["label"]
+    labels = {}
+    throughput = {}
+    for name in [DEFAULT_BACKEND, backend]:
+        # Without a cache every sentence goes through inference
+        model = ScoringModel(max_batch_tokens=max_batch_tokens, backend=name).load()
+        start = time.perf_counter()
+        labels[name] = model.classify(sentences)
+        throughput[name] = len(sentences) / (time.perf_counter() - start)
 
-        labels = pd.DataFrame(pipe_results).replace("none", np.nan)
-        return (~labels.isna()).astype(int).mean().to_dict()
+    report = []
+    for dimension in MODEL_TYPES:
+        baseline = np.array(labels[DEFAULT_BACKEND][dimension])
+        candidate = np.array(labels[backend][dimension])
+        report.append(
+            {
+                "dimension": dimension,
+                "agreement": (baseline == candidate).mean(),
+                "baseline_positive_rate": (baseline != NONE_LABEL).mean(),
+                "backend_positive_rate": (candidate != NONE_LABEL).mean(),
+                "baseline_sentences_per_second": throughput[DEFAULT_BACKEND],
+                "backend_sentences_per_second": throughput[backend],
+            }
+        )
+    report = pd.DataFrame(report).set_index("dimension")
+    report["speedup"] = (
+        report["backend_sentences_per_second"] / report["baseline_sentences_per_second"]
+    )
+    return report
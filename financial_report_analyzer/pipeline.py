@@ -0,0 +1,288 @@
+import multiprocessing
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from financial_report_analyzer.content_extractor import TextExtractor
+
+
+FETCH_THREADS = 4
+PARSE_PROCESSES = 4
+QUEUE_SIZE = 8
+REPORTS_PER_BATCH = 4
+
+# Marks the end of a stream on the stage queues
+END_OF_STREAM = None
+
+
+def extract_report(report, url_type="htm", streaming=False) -> tuple:
+    # Reports are already extracted in parallel, so PDF pages are not fanned out again
+    extractor = TextExtractor(report, pdf_processes=1)
+    sentences = extractor.get_sentences(url_type=url_type, streaming=streaming)
+    return sentences, extractor.create_hash(sentences)
+
+
+class ReportPipeline:
+    """
+    Fetch, extract and score single reports while skipping reports whose text was already scored.
+
+    :param scraper: SECScraper used to download the reports
+    :param model: ScoringModel used to score the sentences
+    :param known_scores: Dict of E/S/G scores keyed by text hash, e.g. from DatabaseConnector.fetch_hash_scores
+    :param streaming_extraction: Extract HTML reports with the streaming parser of TextExtractor
+    :param sentence_store: Optional SentenceStore, stored reports are read from it instead of fetched
+    """
+
+    def __init__(
+        self,
+        scraper,
+        model,
+        known_scores=None,
+        streaming_extraction=False,
+        sentence_store=None,
+    ):
+        self.scraper = scraper
+        self.model = model
+        self.known_scores = known_scores if known_scores is not None else {}
+        self.streaming_extraction = streaming_extraction
+        self.sentence_store = sentence_store
+        self.reused = 0
+
+    def score_batch(self, reports: list) -> list:
+        """
+        Score several reports at once, only running the model on unknown text hashes.
+        :param reports: List of (sentences, text_hash) tuples
+        :return: List of score dicts aligned with reports
+        """
+
+        pending = {}
+        for sentences, text_hash in reports:
+            if text_hash in self.known_scores:
+                self.reused += 1
+            else:
+                pending.setdefault(text_hash, sentences)
+
+        if pending:
+            batch_scores = self.model.calculate_batch_scores(list(pending.values()))
+            for text_hash, report_scores in zip(pending, batch_scores):
+                self.known_scores[text_hash] = dict(report_scores)
+
+        return [dict(self.known_scores[text_hash]) for _, text_hash in reports]
+
+    def score_sentences(self, sentences: list, text_hash: str) -> dict:
+        return self.score_batch([(sentences, text_hash)])[0]
+
+    def create_record(self, report_scores: dict, text_hash: str, **metadata) -> dict:
+        report_scores.update(metadata)
+        report_scores.update(
+            {"analysis_timestamp": datetime.now(), "text_hash": text_hash}
+        )
+        return report_scores
+
+    def is_stored(self, ticker: str, year) -> bool:
+        return self.sentence_store is not None and self.sentence_store.contains(
+            ticker, year
+        )
+
+    def store_sentences(self, ticker: str, year, sentences: list, text_hash: str):
+        if self.sentence_store is not None:
+            self.sentence_store.write(ticker, year, sentences, text_hash)
+
+    def load_sentences(self, ticker: str, year, url: str, url_type="htm") -> tuple:
+        if self.is_stored(ticker, year):
+            return self.sentence_store.read_sentences(ticker, year)
+
+        report = self.scraper.fetch_report(url)
+        sentences, text_hash = extract_report(
+            report, url_type, self.streaming_extraction
+        )
+        self.store_sentences(ticker, year, sentences, text_hash)
+        return sentences, text_hash
+
+    def score_filing(self, ticker: str, year, url: str, url_type="htm") -> dict:
+        sentences, text_hash = self.load_sentences(ticker, year, url, url_type)
+        report_scores = self.score_sentences(sentences, text_hash)
+        return self.create_record(report_scores, text_hash, ticker=ticker, year=year)
+
+
+class StreamingPipeline(ReportPipeline):
+    """
+    Run fetching, extraction and scoring as concurrent stages connected by bounded queues.
+
+    Reports are downloaded on a thread pool, parsed on a process pool and scored in batches
+    in the calling process. A full queue blocks the stage feeding it, so a slow model
+    throttles downloads instead of piling reports up in memory.
+
+    :param scraper: SECScraper used to download the reports
+    :param model: ScoringModel used to score the sentences
+    :param known_scores: Dict of E/S/G scores keyed by text hash
+    :param streaming_extraction: Extract HTML reports with the streaming parser of TextExtractor
+    :param sentence_store: Optional SentenceStore, stored reports are read from it instead of fetched
+    :param fetch_threads: Number of download threads
+    :param parse_processes: Number of extraction processes
+    :param queue_size: Capacity of each stage queue
+    :param reports_per_batch: Maximum number of parsed reports scored in one model pass
+    """
+
+    def __init__(
+        self,
+        scraper,
+        model,
+        known_scores=None,
+        streaming_extraction=False,
+        sentence_store=None,
+        fetch_threads=FETCH_THREADS,
+        parse_processes=PARSE_PROCESSES,
+        queue_size=QUEUE_SIZE,
+        reports_per_batch=REPORTS_PER_BATCH,
+    ):
+        super().__init__(
+            scraper, model, known_scores, streaming_extraction, sentence_store
+        )
+        self.fetch_threads = fetch_threads
+        self.parse_processes = parse_processes
+        self.queue_size = queue_size
+        self.reports_per_batch = reports_per_batch
+
+    def fetch_stage(self, work_items: queue.Queue, fetched: queue.Queue) -> None:
+        while True:
+            try:
+                work_item = work_items.get_nowait()
+            except queue.Empty:
+                return None
+            if self.is_stored(work_item[0], work_item[1]):
+                # Nothing to download, the parse stage reads the stored sentences
+                fetched.put((work_item, None, None))
+                continue
+            try:
+                report = self.scraper.fetch_report(work_item[2])
+                fetched.put((work_item, report, None))
+            except Exception as error:
+                fetched.put((work_item, None, error))
+
+    def parse_stage(self, executor, fetched: queue.Queue, parsed: queue.Queue) -> None:
+        while True:
+            entry = fetched.get()
+            if entry is END_OF_STREAM:
+                parsed.put(END_OF_STREAM)
+                return None
+            work_item, report, error = entry
+            ticker, year, _, url_type = work_item
+            if error is None:
+                try:
+                    if report is None:
+                        result = self.sentence_store.read_sentences(ticker, year)
+                    else:
+                        # Waiting on the result keeps at most one report per thread in flight
+                        result = executor.submit(
+                            extract_report, report, url_type, self.streaming_extraction
+                        ).result()
+                        self.store_sentences(ticker, year, *result)
+                    parsed.put((work_item, result, None))
+                    continue
+                except Exception as parse_error:
+                    error = parse_error
+            parsed.put((work_item, None, error))
+
+    def start_stages(self, work_items: list, parsed: queue.Queue, executor) -> None:
+        pending = queue.Queue()
+        for work_item in work_items:
+            pending.put(work_item)
+        fetched = queue.Queue(maxsize=self.queue_size)
+
+        fetchers = [
+            threading.Thread(
+                target=self.fetch_stage, args=(pending, fetched), daemon=True
+            )
+            for _ in range(self.fetch_threads)
+        ]
+        parsers = [
+            threading.Thread(
+                target=self.parse_stage, args=(executor, fetched, parsed), daemon=True
+            )
+            for _ in range(self.parse_processes)
+        ]
+
+        def close_fetched():
+            for fetcher in fetchers:
+                fetcher.join()
+            for _ in parsers:
+                fetched.put(END_OF_STREAM)
+
+        closer = threading.Thread(target=close_fetched, daemon=True)
+        for thread in fetchers + parsers + [closer]:
+            thread.start()
+        return None
+
+    def next_batch(self, parsed: queue.Queue, open_parsers: int) -> tuple:
+        """
+        Block for one parsed report, then take whatever else is already waiting.
+        """
+
+        batch = []
+        while open_parsers and len(batch) < self.reports_per_batch:
+            try:
+                entry = parsed.get(block=not batch)
+            except queue.Empty:
+                break
+            if entry is END_OF_STREAM:
+                open_parsers -= 1
+            else:
+                batch.append(entry)
+        return batch, open_parsers
+
+    def iter_batches(self, work_items: list):
+        """
+        Run the fetch and parse stages and yield batches of (work_item, (sentences, text_hash), error).
+        """
+
+        parsed = queue.Queue(maxsize=self.queue_size)
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(self.parse_processes, mp_context=context) as executor:
+            self.start_stages(work_items, parsed, executor)
+            open_parsers = self.parse_processes
+
+            while open_parsers:
+                batch, open_parsers = self.next_batch(parsed, open_parsers)
+                yield batch
+
+    def extract(self, work_items: list):
+        """
+        Only fetch and extract the work items, e.g. to fill the sentence store.
+        :param work_items: List of (ticker, year, url, url_type) tuples
+        :return: Generator of dicts with ticker, year and text hash or error of every report
+        """
+
+        for batch in self.iter_batches(work_items):
+            for (ticker, year, _, _), result, error in batch:
+                if error is not None:
+                    yield {"ticker": ticker, "year": year, "error": repr(error)}
+                else:
+                    yield {"ticker": ticker, "year": year, "text_hash": result[1]}
+
+    def run(self, work_items: list):
+        """
+        Stream the work items through the pipeline.
+        :param work_items: List of (ticker, year, url, url_type) tuples
+        :return: Generator of report scores, or dicts with an error key for failed reports
+        """
+
+        for batch in self.iter_batches(work_items):
+            for (ticker, year, _, _), _, error in batch:
+                if error is not None:
+                    yield {"ticker": ticker, "year": year, "error": repr(error)}
+
+            extracted = [entry for entry in batch if entry[2] is None]
+            try:
+                batch_scores = self.score_batch([result for _, result, _ in extracted])
+            except Exception as error:
+                # Like a failed work item in the process pool mode, the stream goes on
+                for (ticker, year, _, _), _, _ in extracted:
+                    yield {"ticker": ticker, "year": year, "error": repr(error)}
+                continue
+            for ((ticker, year, _, _), (_, text_hash), _), report_scores in zip(
+                extracted, batch_scores
+            ):
+                yield self.create_record(
+                    report_scores, text_hash, ticker=ticker, year=year
+                )
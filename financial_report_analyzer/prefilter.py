@@ -0,0 +1,93 @@
+import re
+import numpy as np
+import pandas as pd
+
+
+# Word prefixes of ESG topics, a sentence mentioning none of them is very unlikely to be labeled
+ESG_KEYWORDS = [
+    # Environmental
+    "climate", "emission", "carbon", "greenhouse", "ghg", "energy", "renewable",
+    "environment", "pollut", "waste", "water", "sustainab", "biodiversity", "recycl",
+    "fossil", "solar", "wind", "fuel", "deforest", "hazardous", "spill", "net zero",
+    # Social
+    "employee", "workforce", "diversity", "inclusion", "human rights", "health",
+    "safety", "communit", "labor", "labour", "talent", "training", "well-being",
+    "wellbeing", "privacy", "data protection", "supplier", "supply chain", "philanthrop",
+    "equal", "gender", "women", "wage", "union", "volunteer", "donation", "customer",
+    # Governance
+    "board", "director", "governance", "audit", "compliance", "ethic", "brib",
+    "corrupt", "shareholder", "stockholder", "compensation", "risk management",
+    "internal control", "whistleblow", "independen", "committee", "oversight",
+    "code of conduct", "conflict of interest", "lobby", "political", "anti-trust",
+    "antitrust",
+]
+MIN_WORDS = 5
+MAX_NUMERIC_DENSITY = 0.2
+
+
+class SentencePrefilter:
+    """
+    Cheap heuristic that routes sentences which are clearly not about ESG topics to the none
+    label before any model runs: short fragments, numeric table rows and sentences without
+    any ESG keyword.
+
+    :param keywords: Word prefixes of which a kept sentence must contain at least one
+    :param min_words: Sentences with fewer words are filtered
+    :param max_numeric_density: Sentences with a larger share of digits among their
+        non-space characters are filtered
+    """
+
+    def __init__(
+        self,
+        keywords=None,
+        min_words=MIN_WORDS,
+        max_numeric_density=MAX_NUMERIC_DENSITY,
+    ):
+        keywords = ESG_KEYWORDS if keywords is None else keywords
+        self.keyword_regex = re.compile(
+            r"\b(?:" + "|".join(re.escape(keyword) for keyword in keywords) + ")",
+            re.IGNORECASE,
+        )
+        self.min_words = min_words
+        self.max_numeric_density = max_numeric_density
+
+    def numeric_density(self, sentence: str) -> float:
+        characters = len(sentence) - sentence.count(" ")
+        if not characters:
+            return 0.0
+        return sum(char.isdigit() for char in sentence) / characters
+
+    def is_relevant(self, sentence: str) -> bool:
+        # Ordered from cheapest to most expensive check
+        if len(sentence.split()) < self.min_words:
+            return False
+        if self.numeric_density(sentence) > self.max_numeric_density:
+            return False
+        return self.keyword_regex.search(sentence) is not None
+
+    def keep(self, sentences: list) -> list:
+        return [self.is_relevant(sentence) for sentence in sentences]
+
+    def recall_report(self, sentences: list, labels: dict, none_label="none") -> pd.DataFrame:
+        """
+        Measure the prefilter against the labels of the full models.
+        :param sentences: Sample of cleaned sentences
+        :param labels: Dict of label lists aligned with sentences per dimension, e.g. from ScoringModel.classify
+        :param none_label: Label of sentences without ESG content
+        :return: DF with the positives, recall and filtered share per dimension
+        """
+
+        kept = np.array(self.keep(sentences), dtype=bool)
+        report = []
+        for dimension, dimension_labels in labels.items():
+            positive = np.array(dimension_labels) != none_label
+            report.append(
+                {
+                    "dimension": dimension,
+                    "positives": int(positive.sum()),
+                    "positives_kept": int((positive & kept).sum()),
+                    "recall": (positive & kept).sum() / max(positive.sum(), 1),
+                    "filtered_share": 1 - kept.mean() if len(kept) else 0.0,
+                }
+            )
+        return pd.DataFrame(report).set_index("dimension")
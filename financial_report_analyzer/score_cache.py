@@ -0,0 +1,141 @@
+import hashlib
+import sqlite3
+import time
+from pathlib import Path
+
+
+SCORE_CACHE_PATH = "cache/sentence_scores.sqlite"
+MAX_CACHE_ENTRIES = 10_000_000
+# Stay below SQLite's limit on host parameters per statement
+QUERY_CHUNK_SIZE = 500
+# Stores after which the entry count is read again to include rows written by other processes
+RECOUNT_INTERVAL = 1000
+
+
+class ScoreCache:
+    """
+    Persistent sentence label cache keyed by the SHA-256 of the model name and the cleaned sentence.
+
+    Labels are stored in a SQLite database and the least recently used entries are evicted
+    once the cache grows beyond max_entries. The entry count is tracked from the rows each store
+    inserts, so the table is only counted on start, every RECOUNT_INTERVAL stores and before an
+    eviction.
+
+    :param path: Path of the SQLite database file
+    :param max_entries: Maximum number of cached labels before LRU eviction kicks in
+    """
+
+    def __init__(self, path=SCORE_CACHE_PATH, max_entries=MAX_CACHE_ENTRIES):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS sentence_scores (
+                key TEXT PRIMARY KEY,
+                label TEXT NOT NULL,
+                last_used INTEGER NOT NULL
+            )
+            """
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS sentence_scores_last_used ON sentence_scores (last_used)"
+        )
+        self.connection.commit()
+        self.max_entries = max_entries
+        self.entries = self.count_entries()
+        self.stores_since_count = 0
+        self.hits = 0
+        self.misses = 0
+
+    def count_entries(self) -> int:
+        (entries,) = self.connection.execute(
+            "SELECT COUNT(*) FROM sentence_scores"
+        ).fetchone()
+        return entries
+
+    def create_key(self, sentence: str, model_name: str) -> str:
+        return hashlib.sha256(f"{model_name}\0{sentence}".encode()).hexdigest()
+
+    def get_labels(self, sentences: list, model_name: str) -> list:
+        """
+        Look up the cached labels of the sentences for one model.
+        :param sentences: Cleaned sentences
+        :param model_name: Name of the model that produced the labels
+        :return: List of labels aligned with sentences, None for cache misses
+        """
+
+        keys = [self.create_key(sentence, model_name) for sentence in sentences]
+        unique_keys = list(dict.fromkeys(keys))
+
+        found = {}
+        for start in range(0, len(unique_keys), QUERY_CHUNK_SIZE):
+            chunk = unique_keys[start : start + QUERY_CHUNK_SIZE]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.connection.execute(
+                f"SELECT key, label FROM sentence_scores WHERE key IN ({placeholders})",
+                chunk,
+            )
+            found.update(rows.fetchall())
+
+        # Refresh the recency of every hit so that it survives the next eviction
+        now = time.time_ns()
+        self.connection.executemany(
+            "UPDATE sentence_scores SET last_used = ? WHERE key = ?",
+            [(now, key) for key in found],
+        )
+        self.connection.commit()
+
+        labels = [found.get(key) for key in keys]
+        self.hits += sum(label is not None for label in labels)
+        self.misses += sum(label is None for label in labels)
+        return labels
+
+    def store_labels(self, sentences: list, labels: list, model_name: str) -> None:
+        now = time.time_ns()
+        rows = [
+            (self.create_key(sentence, model_name), label, now)
+            for sentence, label in zip(sentences, labels)
+        ]
+        # Count only new keys, existing keys are refreshed by the update
+        changes = self.connection.total_changes
+        self.connection.executemany(
+            "INSERT OR IGNORE INTO sentence_scores (key, label, last_used) VALUES (?, ?, ?)",
+            rows,
+        )
+        self.entries += self.connection.total_changes - changes
+        self.connection.executemany(
+            "UPDATE sentence_scores SET label = ?, last_used = ? WHERE key = ?",
+            [(label, last_used, key) for key, label, last_used in rows],
+        )
+
+        self.stores_since_count += 1
+        if self.stores_since_count >= RECOUNT_INTERVAL:
+            self.entries = self.count_entries()
+            self.stores_since_count = 0
+        if self.entries > self.max_entries:
+            self.evict()
+        self.connection.commit()
+        return None
+
+    def evict(self) -> None:
+        # Other processes may have evicted in the meantime, the exact count decides
+        entries = self.count_entries()
+        self.entries = entries
+        self.stores_since_count = 0
+        if entries > self.max_entries:
+            self.connection.execute(
+                """
+                DELETE FROM sentence_scores
+                WHERE key IN (
+                    SELECT key FROM sentence_scores ORDER BY last_used LIMIT ?
+                )
+                """,
+                (entries - self.max_entries,),
+            )
+            self.entries = self.max_entries
+        return None
+
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
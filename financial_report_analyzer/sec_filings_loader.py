@@ -1,6 +1,4 @@
 import json
-import time
-from tqdm import tqdm
 from scraping import SECScraper
 from utils import load_tickers
 
@@ -9,15 +7,8 @@ def main():
     tickers = load_tickers(file_name="modified_tickers.yaml")
     sec_scraper = SECScraper()
 
-    filings = {}
-
-    for ticker in tqdm(tickers, ncols=60):
-        try:
-            filings[ticker] = sec_scraper.get_10k_filings(ticker)
-            time.sleep(0.5)
-        except Exception:
-            filings[ticker] = {}
-            continue
+    # Tickers are fetched concurrently, the scraper's rate limiter keeps us within the SEC limits
+    filings = sec_scraper.get_all_10k_filings(tickers)
 
     with open("modified_tickers_filings.json", "w") as f:
         json.dump(filings, f)
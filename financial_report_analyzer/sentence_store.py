@@ -0,0 +1,100 @@
+import hashlib
+from itertools import accumulate
+from pathlib import Path
+import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as ds
+from financial_report_analyzer.utils import atomic_path
+
+
+SENTENCE_STORE_DIR = "cache/sentences"
+SENTENCE_FILE = "sentences.arrow"
+SCHEMA = pa.schema(
+    [
+        ("sentence", pa.string()),
+        ("offset", pa.int64()),
+        ("sentence_hash", pa.string()),
+    ]
+)
+
+
+class SentenceStore:
+    """
+    Columnar store of extracted report sentences, partitioned by ticker and year.
+
+    Every report is one uncompressed Arrow IPC file under ticker=<ticker>/year=<year>, so it can
+    be memory mapped and read without copying. Offsets are character positions of the
+    sentences in their concatenation, the text that TextExtractor.create_hash hashes, and the
+    text hash of the report is kept in the schema metadata.
+
+    :param directory: Root directory of the store
+    """
+
+    def __init__(self, directory=SENTENCE_STORE_DIR):
+        self.directory = Path(directory)
+
+    def create_path(self, ticker: str, year) -> Path:
+        return self.directory / f"ticker={ticker}" / f"year={year}" / SENTENCE_FILE
+
+    def contains(self, ticker: str, year) -> bool:
+        return self.create_path(ticker, year).exists()
+
+    def write(self, ticker: str, year, sentences: list, text_hash: str) -> None:
+        lengths = (len(sentence) for sentence in sentences)
+        offsets = list(accumulate(lengths, initial=0))[:-1]
+        table = pa.table(
+            {
+                "sentence": sentences,
+                "offset": offsets,
+                "sentence_hash": [
+                    hashlib.sha256(sentence.encode()).hexdigest() for sentence in sentences
+                ],
+            },
+            schema=SCHEMA.with_metadata({"text_hash": text_hash}),
+        )
+
+        path = self.create_path(ticker, year)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Readers must never see a half written file, the dot hides it from dataset scans
+        with atomic_path(path) as temporary_path:
+            with pa.OSFile(str(temporary_path), "wb") as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+        return None
+
+    def read(self, ticker: str, year) -> pa.Table:
+        """
+        Memory map the sentences of one report, the returned table references the mapped file.
+        """
+        source = pa.memory_map(str(self.create_path(ticker, year)), "r")
+        return pa.ipc.open_file(source).read_all()
+
+    def read_sentences(self, ticker: str, year) -> tuple:
+        table = self.read(ticker, year)
+        text_hash = table.schema.metadata[b"text_hash"].decode()
+        return table.column("sentence").to_pylist(), text_hash
+
+    def list_reports(self) -> list:
+        return sorted(
+            (path.parent.parent.name.split("=", 1)[1], path.parent.name.split("=", 1)[1])
+            for path in self.directory.glob(f"ticker=*/year=*/{SENTENCE_FILE}")
+        )
+
+    def dataset(self) -> ds.Dataset:
+        """
+        All stored sentences as one Arrow dataset with ticker and year partition columns.
+        """
+        return ds.dataset(
+            self.directory,
+            format="ipc",
+            partitioning="hive",
+        )
+
+    def sample_sentences(self, size: int, seed=0) -> list:
+        """
+        Draw a random sample of stored sentences across all reports.
+        """
+        sentences = self.dataset().to_table(columns=["sentence"]).column("sentence")
+        rng = np.random.default_rng(seed)
+        indices = rng.choice(len(sentences), min(size, len(sentences)), replace=False)
+        return sentences.take(np.sort(indices)).to_pylist()
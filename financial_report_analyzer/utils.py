@@ -1,4 +1,8 @@
 import json
+import os
+import shutil
+import threading
+from contextlib import contextmanager
 from pathlib import Path
 import pandas as pd
 import yaml
@@ -6,6 +10,35 @@ import yaml
 DEFAULTS_PATH = Path(__file__).parent / "defaults"
 
 
+def create_temporary_path(path: Path) -> Path:
+    # Unique per process and thread, the leading dot hides it from directory scans
+    path = Path(path)
+    return path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+
+
+def remove_path(path: Path) -> None:
+    if path.is_dir():
+        shutil.rmtree(path, ignore_errors=True)
+    elif path.exists():
+        path.unlink()
+    return None
+
+
+@contextmanager
+def atomic_path(path: Path):
+    """
+    Yield a temporary path to write a file or directory to, which replaces path once written.
+    Readers never see a half written path, and a failed write leaves no temporary file behind.
+    """
+    temporary_path = create_temporary_path(path)
+    try:
+        yield temporary_path
+        os.replace(temporary_path, path)
+    except BaseException:
+        remove_path(temporary_path)
+        raise
+
+
 def load_ticker_data(file_name="tickers.yaml"):
     with open(DEFAULTS_PATH / file_name, "r") as f:
         ticker_data = yaml.load(f, Loader=yaml.FullLoader)
@@ -25,6 +58,12 @@ def load_filings(tickers_name):
     return filings
 
 
+def load_default_filings(file_name="filings.json"):
+    with open(DEFAULTS_PATH / file_name, "r") as f:
+        filings = json.load(f)
+    return filings
+
+
 def create_filings_table(filings):
     rows = []
     for ticker, years in filings.items():
@@ -3,6 +3,118 @@ import numpy as np
 from loguru import logger
 
 
+CAPPING_ERROR = 0.001
+
+
+def water_fill(amounts: np.ndarray, capping_percent: float, error: float) -> tuple:
+    """
+    Sort based water-filling on every row of a (rows x groups) matrix at once, NaN marks groups
+    that are not part of a row. Groups above the cap are set to the cap and the excess is spread
+    over the remaining groups in proportion to their amounts, which is the fixed point the
+    iterative capping converges to. Sorted descending, the capped groups of a row are the shortest
+    prefix after which the largest remaining group, scaled up, stays within the cap.
+    :return: Tuple of the capped amounts, the capped mask, the capped group count and up factor per row
+    """
+
+    values = np.nan_to_num(amounts)
+    rows, groups = values.shape
+    totals = values.sum(axis=1, keepdims=True)
+    caps = capping_percent * totals
+    order = np.argsort(-values, axis=1, kind="stable")
+    sorted_values = np.take_along_axis(values, order, axis=1)
+
+    # Candidate k caps the k largest groups, their excess goes to the others with up_factors[:, k]
+    capped_counts = np.arange(groups)
+    remaining = totals - np.concatenate(
+        [np.zeros((rows, 1)), np.cumsum(sorted_values, axis=1)[:, :-1]], axis=1
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        up_factors = (totals - capped_counts * caps) / remaining
+        feasible = ~(up_factors * sorted_values > caps + error)
+    # Without a feasible candidate every group ends up at the cap
+    n_capped = np.where(feasible.any(axis=1), feasible.argmax(axis=1), groups)
+    up_factor = np.take_along_axis(
+        np.concatenate([up_factors, np.full((rows, 1), np.nan)], axis=1),
+        n_capped[:, None],
+        axis=1,
+    )[:, 0]
+
+    ranks = np.empty_like(order)
+    np.put_along_axis(ranks, order, capped_counts[None, :], axis=1)
+    capped = ranks < n_capped[:, None]
+    capped_amounts = np.where(capped, caps, values * up_factor[:, None])
+    capped_amounts[np.isnan(amounts)] = np.nan
+    return capped_amounts, capped, n_capped, up_factor
+
+
+def solve_capping(
+    group_totals: np.ndarray, capping_percent: float, error: float = CAPPING_ERROR
+) -> tuple:
+    """
+    Closed form capping of the group totals of one index, see water_fill.
+    :param group_totals: Array of the initial amount of each group
+    :param capping_percent: Maximum share of a group in the total amount
+    :param error: Tolerance above the cap amount before a group is capped
+    :return: Tuple of the capped group totals, a boolean array of the capped groups and a dict of stats
+    """
+
+    group_totals = np.asarray(group_totals, dtype=float)
+    capped_amounts, capped, n_capped, up_factor = water_fill(
+        group_totals[None, :], capping_percent, error
+    )
+    capped_totals = capped_amounts[0]
+
+    total = group_totals.sum()
+    max_excess = (capped_totals.max() - capping_percent * total) if len(capped_totals) else 0.0
+    stats = {
+        # Every water-filling step pins one more group to the cap
+        "iterations": int(n_capped[0]),
+        "up_factor": up_factor[0],
+        "max_excess": max_excess,
+        "converged": bool(max_excess <= error)
+        and bool(np.isclose(capped_totals.sum(), total)),
+    }
+    return capped_totals, capped[0], stats
+
+
+def cap_weight_matrix(
+    amounts, capping_percent: float, error: float = CAPPING_ERROR
+) -> tuple:
+    """
+    Capped weights of many index compositions at once, e.g. one row per rebalancing date.
+    :param amounts: (dates x constituents) DF or array of market capitalizations, NaN for non members
+    :param capping_percent: Maximum weight of a constituent
+    :param error: Tolerance above the cap amount before a constituent is capped
+    :return: Tuple of the capped weight matrix, NaN for non members, and a DF of stats per row
+    """
+
+    values = np.asarray(amounts, dtype=float)
+    members = (~np.isnan(values)).sum(axis=1)
+    implausible = (members > 0) & (capping_percent < 1 / np.maximum(members, 1))
+    if implausible.any():
+        raise ValueError(
+            f"The capping percentage is lower than the minimum needed to run a capping algorithm "
+            f"on {implausible.sum()} row(s) with too few constituents"
+        )
+
+    capped_amounts, _, n_capped, up_factor = water_fill(values, capping_percent, error)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        weights = capped_amounts / np.nansum(values, axis=1, keepdims=True)
+    stats = pd.DataFrame(
+        {
+            "constituents": members,
+            "iterations": n_capped,
+            "up_factor": up_factor,
+            "max_weight": np.nanmax(np.where(members[:, None] > 0, weights, 0), axis=1),
+        }
+    )
+
+    if isinstance(amounts, pd.DataFrame):
+        weights = pd.DataFrame(weights, index=amounts.index, columns=amounts.columns)
+        stats.index = amounts.index
+    return weights, stats
+
+
 class OneDimensionCapping:
     """
     This class is performing a one dimensional capping, e.g. issuer.
@@ -74,67 +186,27 @@ class OneDimensionCapping:
         self.checking_capping_plausibility()
         self.dataframe = self.prep_capping()
 
-        # Calculating the maximum Market Capitalization accepted for any dimension
-        capped_market_value_amount = self.capping_percent * (
-            self.dataframe["initial_amount"].sum()
+        # Summing up the market capitalization of every member of the dimension included in the index
+        codes, _ = pd.factorize(self.dataframe[self.dimension])
+        initial_amount = self.dataframe["initial_amount"].to_numpy(dtype=float)
+        group_totals = np.bincount(
+            codes, weights=np.nan_to_num(initial_amount), minlength=codes.max() + 1
         )
-        # Getting the sums of all members of the dimension included in the index
-        group_object = self.dataframe.groupby(self.dimension).sum(numeric_only=True)
-
-        # Now starts the while loop tha performs the capping by checking if any dimension MV exceeds the cap
-        while any(
-            group_object.loc[:, "capped_amount"]
-            > capped_market_value_amount + self.error
-        ):
-            self.iterations = self.iterations + 1
-
-            for i in group_object.index:
-                # For any dimension exceeding the cap; the capping procedure is applied
-                # First we get the amount exceeding the cap and then we set the capping flag of the dimension to 0
-                # so it is not capped again if the loop is to continue
-                if group_object.loc[i, "capped_amount"] > (
-                    capped_market_value_amount + self.error
-                ):
-                    over_amount = (
-                        group_object.loc[i, "capped_amount"]
-                        - capped_market_value_amount
-                    )
-                    self.dataframe["capping_flag"] = np.where(
-                        self.dataframe[self.dimension] == i,
-                        0,
-                        self.dataframe["capping_flag"],
-                    )
-
-                    # Calculating the down factor which will decrease the weightings of the overly weighted members
-                    down_factor = (
-                        capped_market_value_amount
-                        / group_object.loc[i, "capped_amount"]
-                    )
-                    self.dataframe["capped_amount"] = np.where(
-                        self.dataframe[self.dimension] == i,
-                        self.dataframe["capped_amount"] * down_factor,
-                        self.dataframe["capped_amount"],
-                    )
-
-                    # Calculating the up factor which will be used to increase the weightings of the remaining companies
-                    sum_amount_remaining_members = self.dataframe.loc[
-                        self.dataframe["capping_flag"] == 1
-                    ]["capped_amount"].sum()
-
-                    up_factor = (
-                        sum_amount_remaining_members + over_amount
-                    ) / sum_amount_remaining_members
-                    self.dataframe["capped_amount"] = np.where(
-                        self.dataframe["capping_flag"] == 1,
-                        self.dataframe["capped_amount"] * up_factor,
-                        self.dataframe["capped_amount"],
-                    )
-
-                    # Recalculating the dimension sums after the application of the capping iteration
-                    group_object = self.dataframe.groupby(self.dimension).sum(
-                        numeric_only=True
-                    )
 
+        # Solving the capping for all dimensions at once instead of iterating over them
+        capped_totals, capped, self.stats = solve_capping(
+            group_totals, self.capping_percent, self.error
+        )
+        self.iterations = self.stats["iterations"]
+
+        if self.iterations:
+            # Every member is scaled by the factor of its dimension, down for capped ones and up for the others
+            with np.errstate(divide="ignore", invalid="ignore"):
+                group_factors = np.where(
+                    group_totals > 0, capped_totals / group_totals, 1.0
+                )
+            self.dataframe["capped_amount"] = initial_amount * group_factors[codes]
+            self.dataframe["capping_flag"] = np.where(capped[codes], 0, 1)
             self.dataframe["cap_factor"] = (
                 self.dataframe["capped_amount"] / self.dataframe["initial_amount"]
             )
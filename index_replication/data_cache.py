@@ -0,0 +1,88 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+import pandas as pd
+import pyarrow.feather as feather
+from financial_report_analyzer.utils import atomic_path
+
+
+CACHE_DIR = "cache/prepared"
+HASH_FILE = "source_hashes.json"
+HASH_CHUNK_SIZE = 1 << 24
+
+
+def hash_file(path) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class PreparedDataCache:
+    """
+    Cache of typed, prepared data panels keyed by the SHA-256 hash of their source file.
+
+    Every panel is one uncompressed Feather (Arrow IPC) file, so later runs memory map it instead
+    of parsing the CSV again. Hashing a multi GB source takes seconds, so the hash of every source
+    is kept together with its size and modification time and only recomputed when those change.
+
+    :param directory: Directory of the cached panels
+    """
+
+    def __init__(self, directory=CACHE_DIR):
+        self.directory = Path(directory)
+
+    def read_hashes(self) -> dict:
+        path = self.directory / HASH_FILE
+        if not path.exists():
+            return {}
+        return json.loads(path.read_text())
+
+    def write_hashes(self, hashes: dict) -> None:
+        path = self.directory / HASH_FILE
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with atomic_path(path) as temporary_path:
+            temporary_path.write_text(json.dumps(hashes, indent=2))
+        return None
+
+    def source_hash(self, source) -> str:
+        stat = os.stat(source)
+        fingerprint = [stat.st_size, stat.st_mtime_ns]
+        key = str(Path(source).resolve())
+
+        hashes = self.read_hashes()
+        if hashes.get(key, {}).get("fingerprint") != fingerprint:
+            hashes[key] = {"fingerprint": fingerprint, "sha256": hash_file(source)}
+            self.write_hashes(hashes)
+        return hashes[key]["sha256"]
+
+    def create_path(self, name: str, source_hash: str) -> Path:
+        return self.directory / f"{name}-{source_hash[:16]}.feather"
+
+    def write(self, df: pd.DataFrame, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Readers must never see a half written file
+        with atomic_path(path) as temporary_path:
+            feather.write_feather(df, str(temporary_path), compression="uncompressed")
+        return None
+
+    def read(self, path: Path) -> pd.DataFrame:
+        # Columns without missing values are used straight from the mapped file
+        table = feather.read_table(str(path), memory_map=True)
+        return table.to_pandas(split_blocks=True)
+
+    def load(self, source, name: str, prepare) -> pd.DataFrame:
+        """
+        Load the prepared panel of a source file, preparing and caching it on the first call.
+        :param source: Path to the raw data
+        :param name: Name of the panel, bump its version when the preparation changes
+        :param prepare: Function that parses the source file into the panel
+        :return: DF of the prepared panel
+        """
+
+        path = self.create_path(name, self.source_hash(source))
+        if not path.exists():
+            self.write(prepare(source), path)
+        return self.read(path)
@@ -1,32 +1,77 @@
 import pandas as pd
 import numpy as np
 from datetime import timedelta
-from capping import OneDimensionCapping
+from capping import cap_weight_matrix
+from data_cache import PreparedDataCache
+from replication_engine import ReplicationEngine, create_cumulative_index
+
+
+# Index methodology: the 50 largest ESG conform companies, each capped at 7%
+CAPPING_PERCENT = 0.07
+N_CONSTITUENTS = 50
+END_DATE = pd.Timestamp("2023-12-31")
+# Name of the cached panel, bump the version when read_data changes
+CACHE_NAME = "dax50esg-v1"
+# Ids and industry exposures repeat on every date and are parsed as categoricals
+COLUMN_TYPES = {
+    "isin": "category",
+    "price": "float64",
+    "market capitalization in milion": "float64",
+    "environmental_normalized": "float64",
+    "social_normalized": "float64",
+    "governance_normalized": "float64",
+    "esg_normalized": "float64",
+    "industry exposure": "category",
+}
 
 
 class DAX50ESGIndexReplication:
-    def __init__(self):
-        pass
-
-    def replicate_index(self, path: str, excluded_companies: list) -> pd.DataFrame:
+    # Methodology defaults, read by the parameter sweep for parameters missing in its grid
+    CAPPING_PERCENT = CAPPING_PERCENT
+    N_CONSTITUENTS = N_CONSTITUENTS
+
+    def __init__(self, cache_dir=None):
+        # With a cache directory the parsed raw data is stored and memory mapped on later runs
+        self.cache = PreparedDataCache(cache_dir) if cache_dir else None
+        # One-way turnover at every rebalance date for each rebalance factor, set by index_replication
+        self.turnover = {}
+
+    def replicate_index(
+        self, path: str, excluded_companies: list, drift_weights: bool = False
+    ) -> pd.DataFrame:
         """
         Combine steps to replicate DAX 50 ESG back to base date September 24th, 2012
         :param path: String to raw data
+        :param drift_weights: Hold the rebalance weights and let them drift instead of keeping them constant
         :return: Cumulative index development until today
         """
 
-        data_dax50 = self.data_preparation(path, excluded_companies)
-        data_dax50 = self.evaluate_industry_exposure(data_dax50)
-        dax50_rebalance_factors = self.get_mktcap_on_reference_date(data_dax50)
+        data_dax50, dax50_rebalance_factors = self.prepare_data(
+            path, excluded_companies
+        )
         index_composition_dict = self.get_index_composition(
             dax50_rebalance_factors, data_dax50
         )
         cumulative_index_return = self.index_replication(
-            index_composition_dict, data_dax50
+            index_composition_dict, data_dax50, drift_weights
         )
 
         return cumulative_index_return
 
+    def prepare_data(self, path: str, excluded_companies: list = ()) -> tuple:
+        """
+        Load the raw data and get the rebalance factors, the steps shared by all index variants
+        :param path: String to raw data
+        :param excluded_companies: Companies dropped from the raw data
+        :return: Tuple of the prepared DAX 50 data and the dict of rebalance factors
+        """
+
+        data_dax50 = self.data_preparation(path, excluded_companies)
+        data_dax50 = self.evaluate_industry_exposure(data_dax50)
+        dax50_rebalance_factors = self.get_mktcap_on_reference_date(data_dax50)
+
+        return data_dax50, dax50_rebalance_factors
+
     def data_preparation(self, path: str, excluded_companies: list) -> pd.DataFrame:
         """
         Prepare the data to replicate DAX 50 ESG back to base date September 24th, 2012
@@ -34,15 +79,31 @@ class DAX50ESGIndexReplication:
         :return: DF of DAX 50 ESG raw data
         """
 
+        if self.cache is None:
+            data_dax50 = self.read_data(path)
+        else:
+            data_dax50 = self.cache.load(path, CACHE_NAME, self.read_data)
+        # Drop excluded companies, returns are computed per company and need no recalculation
+        return data_dax50[
+            ~data_dax50.index.get_level_values("isin").isin(excluded_companies)
+        ]
+
+    def read_data(self, path: str) -> pd.DataFrame:
+        """
+        Parse the raw data with explicit types and get the returns of all companies.
+        :param path: String to raw data
+        :return: DF of DAX 50 raw data indexed by isin and date
+        """
+
         # Load data and set index, isin is an unique company identifier
-        data_dax50 = pd.read_csv(path).drop(columns="Unnamed: 0")
-        # Drop excluded companies
-        data_dax50 = data_dax50[~data_dax50["isin"].isin(excluded_companies)]
+        data_dax50 = pd.read_csv(
+            path, dtype=COLUMN_TYPES, parse_dates=["date"]
+        ).drop(columns="Unnamed: 0")
         # Get returns for the isins
         data_dax50["return"] = (
-            data_dax50.groupby("isin")["price"]
-            .apply(lambda x: (x / x.shift(1)) - 1)
-            .reset_index(level=0, drop=True)
+            data_dax50["price"]
+            / data_dax50.groupby("isin", observed=True)["price"].shift(1)
+            - 1
         )
         data_dax50 = data_dax50.set_index(["isin", "date"]).rename(
             columns={
@@ -54,19 +115,9 @@ class DAX50ESGIndexReplication:
             }
         )
         # Exclude data before September 21th, 2012 as this is the reference date for the base date of Dax 50 ESG
-        data_dax50 = data_dax50.loc[
-            data_dax50.index.get_level_values("date") >= "2012-09-21"
+        return data_dax50.loc[
+            data_dax50.index.get_level_values("date") >= pd.Timestamp(2012, 9, 21)
         ]
-        # Setting the datetime format
-        data_dax50.index = pd.MultiIndex.from_arrays(
-            [
-                data_dax50.index.get_level_values("isin"),
-                pd.to_datetime(data_dax50.index.get_level_values("date")),
-            ],
-            names=["isin", "date"],
-        )
-
-        return data_dax50
 
     def evaluate_industry_exposure(self, data_dax50: pd.DataFrame) -> pd.DataFrame:
         """
@@ -79,17 +130,20 @@ class DAX50ESGIndexReplication:
         non_esg = ["CW", "FA", "MC", "NP", "OS", "TC", "TP"]
 
         # We assume that companies with nan values are esg conform
-        data_dax50.loc[:, "industry exposure"] = (
-            data_dax50["industry exposure"]
-            .replace(np.nan, "0")
-            .replace("#N/A Invalid Security", "0")
+        industry_exposure = data_dax50["industry exposure"].astype("category")
+        if "0" not in industry_exposure.cat.categories:
+            industry_exposure = industry_exposure.cat.add_categories("0")
+        industry_exposure = industry_exposure.fillna("0")
+        data_dax50["industry exposure"] = industry_exposure.where(
+            industry_exposure != "#N/A Invalid Security", "0"
         )
 
-        # Function to check if any string in non_esg is present in a given row of industry exposure
-        def check_non_esg(row):
-            return any(substring in row["industry exposure"] for substring in non_esg)
-
-        data_dax50["non esg"] = data_dax50.apply(check_non_esg, axis=1).astype(int)
+        # Check if any string in non_esg is present in the industry exposure, once per distinct exposure
+        data_dax50["non esg"] = (
+            data_dax50["industry exposure"]
+            .str.contains("|".join(non_esg), regex=True)
+            .astype(int)
+        )
 
         return data_dax50
 
@@ -150,12 +204,20 @@ class DAX50ESGIndexReplication:
         return rebalance_factors
 
     def get_index_composition(
-        self, rebalance_factors: dict, data_dax50: pd.DataFrame
+        self,
+        rebalance_factors: dict,
+        data_dax50: pd.DataFrame,
+        capping_percent: float = CAPPING_PERCENT,
+        n_constituents: int = N_CONSTITUENTS,
+        excluded_companies: list = (),
     ) -> dict:
         """
         Create the index composition for the DAX 50 ESG index based on the reference date for rebalancing
         :param rebalance_factors: Dict with DataFrames for each rebalance factor
         :param data_dax50: Prepared DAX 50 data
+        :param capping_percent: Maximum weight of a constituent in the market cap weighted index, None for no capping
+        :param n_constituents: Number of largest companies included in the index
+        :param excluded_companies: Companies excluded from the index on top of the non ESG companies
         :return: Dict with index composition for the DAX 50 ESG index based on the reference date for rebalancing for each factor
         """
 
@@ -176,136 +238,82 @@ class DAX50ESGIndexReplication:
                 "Market capitalization data (mktcap) is required in rebalance_factors."
             )
 
-        # Determine the constituents based on market capitalization
-        mktcap_composition = pd.DataFrame()
-        top_50_isins_by_date = {}
-        for date in mktcap_df.index:
-            constituents = mktcap_df.loc[
-                date
-            ].copy()  # Ensure to make a copy to avoid modifying original data
-            # Exclude companies based on non_esg_isins
-            constituents.drop(
-                index=[isin for isin in non_esg_isins if isin in constituents.index],
-                inplace=True,
-            )
-            # Select the top 50 by market capitalization
-            constituents = (
-                constituents.sort_values(ascending=False)
-                .head(50)
-                .to_frame(name="mktcap")
-                .reset_index()
-            )
-            # Store the top 50 ISINs for this date
-            top_50_isins_by_date[date] = constituents["isin"].tolist()
-            # Apply capping to market capitalization
-            constituents_overview = OneDimensionCapping(
-                data=constituents, capping_percent=0.07, dimension="isin"
-            ).run_capping()
-            constituents_overview.set_index("isin", inplace=True)
-            # Get constituents weights including capping
-            constituent_weight = (
-                constituents_overview["capped_amount"]
-                / constituents_overview["mktcap"].sum()
+        # Exclude companies based on non_esg_isins
+        excluded_isins = non_esg_isins.union(excluded_companies)
+        eligible_mktcap = mktcap_df.drop(
+            columns=[isin for isin in excluded_isins if isin in mktcap_df.columns]
+        )
+        # Select the largest companies by market capitalization on every rebalancing date
+        constituents = (
+            eligible_mktcap.rank(axis=1, ascending=False, method="first")
+            <= n_constituents
+        )
+        # Apply capping to the market capitalization of all rebalancing dates at once
+        constituent_mktcap = eligible_mktcap.where(constituents)
+        if capping_percent is None:
+            mktcap_composition = constituent_mktcap.div(
+                constituent_mktcap.sum(axis=1), axis=0
             )
-            mktcap_composition = pd.concat(
-                [mktcap_composition, constituent_weight.to_frame(name=date).T], axis=0
+        else:
+            mktcap_composition, _ = cap_weight_matrix(
+                constituent_mktcap, capping_percent
             )
 
         # Store the market capitalization composition
-        index_composition_dict["mktcap"] = mktcap_composition
+        index_composition_dict["mktcap"] = mktcap_composition.dropna(axis=1, how="all")
 
         # Use the same constituents for other factors and calculate their weights
         for factor, factor_df in rebalance_factors.items():
             if factor == "mktcap":
                 continue  # Skip mktcap as it's already processed
-            factor_composition = pd.DataFrame()
-            for date in factor_df.index:
-                # Use the top 50 ISINs determined from the market cap
-                top_50_isins = top_50_isins_by_date.get(date, [])
-                constituents = (
-                    factor_df.loc[date, top_50_isins].dropna().to_frame(name=factor).T
-                )
-                constituents.index = [date]
-                # Calculate the weights based on the factor
-                factor_weight_sum = constituents.sum(axis=1)
-                factor_weight = constituents.div(factor_weight_sum, axis=0)
-                factor_composition = pd.concat(
-                    [factor_composition, factor_weight], axis=0
-                )
+            factor_constituents = constituents.reindex(
+                index=factor_df.index, columns=factor_df.columns, fill_value=False
+            )
+            factor_values = factor_df.where(factor_constituents)
+            # Calculate the weights based on the factor
+            factor_composition = factor_values.div(factor_values.sum(axis=1), axis=0)
 
             # Store the factor composition
-            index_composition_dict[factor] = factor_composition
+            index_composition_dict[factor] = factor_composition.dropna(
+                axis=1, how="all"
+            )
 
         return index_composition_dict
 
+    def create_engine(self, data_dax50: pd.DataFrame) -> ReplicationEngine:
+        # Pivot the companies returns once into a float matrix shared by all factors
+        return ReplicationEngine.from_panel(data_dax50, "return", "isin")
+
+    def create_periods(self, index_composition: pd.DataFrame) -> tuple:
+        # Each composition is held from the next business day until the following rebalancing date,
+        # the index calculation ends at 31st of December 2023
+        period_starts = index_composition.index + pd.offsets.BDay()
+        period_ends = list(index_composition.index[1:]) + [END_DATE]
+        return period_starts, period_ends
+
     def index_replication(
-        self, index_composition_dict: dict, data_dax50: pd.DataFrame
+        self,
+        index_composition_dict: dict,
+        data_dax50: pd.DataFrame,
+        drift_weights: bool = False,
     ) -> dict:
         """
         Replicate DAX 50 ESG back to base date September 24th, 2012 for each rebalance factor
         :param index_composition_dict: Dict with index compositions for each rebalance factor
         :param data_dax50: DF of DAX 50 raw data
+        :param drift_weights: Hold the rebalance weights and let them drift instead of keeping them constant
         :return: Dict with cumulative index returns for each rebalance factor
         """
 
-        # Create a df that only contains the companies returns
-        returns_df = data_dax50.reset_index().pivot(
-            index="date", columns="isin", values="return"
-        )
+        engine = self.create_engine(data_dax50)
 
         cumulative_returns_dict = {}
 
         for factor, index_composition in index_composition_dict.items():
-            index_returns = pd.DataFrame()
-            # Get the next business day for each timestamp in index_composition
-            next_business_days = index_composition.index.map(
-                lambda x: x + pd.offsets.BDay()
+            period_starts, period_ends = self.create_periods(index_composition)
+            index_returns, self.turnover[factor] = engine.simulate(
+                index_composition, period_starts, period_ends, drift_weights
             )
-
-            for i, date in enumerate(index_composition.index):
-                # Ensure that we're not at the last index to avoid an out-of-range error
-                if i < len(index_composition.index) - 1:
-                    start_date = next_business_days[
-                        i
-                    ]  # Use the next business day as the start date
-                    end_date = index_composition.index[
-                        i + 1
-                    ]  # Use the next timestamp as the end date
-                else:
-                    start_date = next_business_days[
-                        i
-                    ]  # Use the next business day as the start date
-                    end_date = pd.to_datetime(
-                        "2023-12-31"
-                    )  # Index calculation ends at 31st of December 2023
-
-                # Get index weights for the current period
-                index_weights_period = index_composition.loc[date].dropna()
-
-                # Get daily weighted returns per company
-                weighted_returns = pd.DataFrame(
-                    index=returns_df.loc[start_date:end_date].index,
-                    columns=index_weights_period.index,
-                )
-                for isin in index_weights_period.index:
-                    weighted_returns[isin] = (
-                        returns_df.loc[start_date:end_date][isin]
-                        * index_weights_period.loc[isin]
-                    )
-
-                daily_index_return = weighted_returns.sum(axis=1)
-                index_returns = pd.concat([index_returns, daily_index_return])
-
-            cumulative_index_return = (
-                (1 + index_returns)
-                .cumprod()
-                .rename(columns={0: "Cumulative Index Return"})
-            )
-            # Normalize returns and create base value of 100
-            cumulative_index_return = (
-                cumulative_index_return / cumulative_index_return.iloc[0]
-            ) * 100
-
-            cumulative_returns_dict[factor] = cumulative_index_return
+            cumulative_returns_dict[factor] = create_cumulative_index(index_returns)
 
         return cumulative_returns_dict
@@ -1,12 +1,14 @@
 from sp500esg_replication import SP500ESGIndexReplication
 from dax50esg_repl import DAX50ESGIndexReplication
 from plot_cum_returns import plot_cumulative_returns
+from data_cache import CACHE_DIR
 import pandas as pd
 
 
 def main():
-    sp500esg_index_replication = SP500ESGIndexReplication()
-    dax50esg_index_replication = DAX50ESGIndexReplication()
+    # Parsed raw data is cached, later runs memory map it instead of reading the CSVs
+    sp500esg_index_replication = SP500ESGIndexReplication(cache_dir=CACHE_DIR)
+    dax50esg_index_replication = DAX50ESGIndexReplication(cache_dir=CACHE_DIR)
 
     excluded_companies_sp500_esg = pd.read_excel(
         r"YOUR_PATH"
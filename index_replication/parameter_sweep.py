@@ -0,0 +1,150 @@
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from replication_engine import RETURN_COLUMN, create_cumulative_index
+
+
+SWEEP_PARAMETERS = [
+    "n_constituents",
+    "capping_percent",
+    "exclusions",
+    "factor",
+    "drift_weights",
+]
+DEFAULT_FACTORS = ["mktcap", "environmental", "social", "governance", "esg"]
+RESULTS_PATH = "index_replication_sweep.parquet"
+
+# Prepared data of the sweep, set once per worker process by init_worker
+SWEEP_STATE = {}
+
+
+def create_variants(grid: dict, replication) -> list:
+    """
+    Expand a grid of methodology parameters into the list of index variants.
+    :param grid: Dict of parameter -> list of values, exclusions is a dict of name -> list of excluded companies.
+                 Missing parameters use the methodology defaults of the replication
+    :param replication: Index replication with the N_CONSTITUENTS and CAPPING_PERCENT defaults
+    :return: List of variant dicts
+    """
+
+    exclusions = grid.get("exclusions", {"none": []})
+    values = {
+        "n_constituents": grid.get("n_constituents", [replication.N_CONSTITUENTS]),
+        "capping_percent": grid.get("capping_percent", [replication.CAPPING_PERCENT]),
+        "exclusions": list(exclusions),
+        "factor": grid.get("factor", DEFAULT_FACTORS),
+        "drift_weights": grid.get("drift_weights", [False]),
+    }
+
+    variants = []
+    for number, combination in enumerate(
+        itertools.product(*[values[parameter] for parameter in SWEEP_PARAMETERS])
+    ):
+        variant = dict(zip(SWEEP_PARAMETERS, combination))
+        variant["variant"] = number
+        variant["excluded_companies"] = list(exclusions[variant["exclusions"]])
+        variants.append(variant)
+    return variants
+
+
+def init_worker(replication, data: pd.DataFrame, rebalance_factors: dict, engine) -> None:
+    # Every worker receives the prepared data once instead of with every variant
+    SWEEP_STATE["replication"] = replication
+    SWEEP_STATE["data"] = data
+    SWEEP_STATE["rebalance_factors"] = rebalance_factors
+    SWEEP_STATE["engine"] = engine
+    return None
+
+
+def run_variant(variant: dict) -> pd.DataFrame:
+    """
+    Replicate one index variant with the prepared data of the worker.
+    :param variant: Variant dict of create_variants
+    :return: DF of the daily and cumulative index returns with the variant parameters
+    """
+
+    replication = SWEEP_STATE["replication"]
+    rebalance_factors = SWEEP_STATE["rebalance_factors"]
+    factor = variant["factor"]
+
+    # Market capitalization selects the constituents of every factor
+    index_compositions = replication.get_index_composition(
+        {name: rebalance_factors[name] for name in dict.fromkeys(["mktcap", factor])},
+        SWEEP_STATE["data"],
+        excluded_companies=variant["excluded_companies"],
+        capping_percent=variant["capping_percent"],
+        n_constituents=variant["n_constituents"],
+    )
+    index_composition = index_compositions[factor]
+    period_starts, period_ends = replication.create_periods(index_composition)
+    index_returns, turnover = SWEEP_STATE["engine"].simulate(
+        index_composition, period_starts, period_ends, variant["drift_weights"]
+    )
+
+    results = create_cumulative_index(index_returns)
+    results.insert(0, "index_return", index_returns)
+    results = results.rename_axis("date").reset_index()
+    for parameter in ["variant", *SWEEP_PARAMETERS]:
+        results[parameter] = variant[parameter]
+    results["mean_turnover"] = turnover.mean()
+    return results
+
+
+class ParameterSweep:
+    """
+    Replicate many variants of an index methodology from a single data preparation.
+
+    The raw data is loaded, the rebalance factors are computed and the returns are pivoted once,
+    then every variant of the parameter grid only builds its index composition and runs the
+    replication engine. Variants are spread over a process pool and all results are written to
+    one Parquet file in long format, one row per variant and date.
+
+    :param replication: Index replication, e.g. SP500ESGIndexReplication() or DAX50ESGIndexReplication()
+    :param max_workers: Number of worker processes, defaults to the number of CPUs
+    """
+
+    def __init__(self, replication, max_workers=None):
+        self.replication = replication
+        self.max_workers = max_workers or os.cpu_count()
+        self.data = None
+        self.rebalance_factors = None
+        self.engine = None
+
+    def prepare(self, path: str):
+        """
+        Load the raw data without exclusions, every variant applies its own exclusion list.
+        :param path: String to raw data
+        """
+
+        self.data, self.rebalance_factors = self.replication.prepare_data(path)
+        self.engine = self.replication.create_engine(self.data)
+        # Workers only need the industry exposure flags of the raw data
+        self.data = self.data[["non esg"]]
+        return self
+
+    def run(self, grid: dict, results_path=RESULTS_PATH) -> pd.DataFrame:
+        """
+        Replicate all variants of the grid and store the results.
+        :param grid: Dict of parameter -> list of values, see create_variants
+        :param results_path: Parquet file the results are written to
+        :return: DF of the daily and cumulative index returns of all variants
+        """
+
+        if self.engine is None:
+            raise ValueError("Prepare the data with prepare(path) before running the sweep")
+
+        variants = create_variants(grid, self.replication)
+        with ProcessPoolExecutor(
+            max_workers=min(self.max_workers, len(variants)),
+            initializer=init_worker,
+            initargs=(self.replication, self.data, self.rebalance_factors, self.engine),
+        ) as executor:
+            results = list(executor.map(run_variant, variants))
+
+        results = pd.concat(results, ignore_index=True)
+        results = results[
+            ["variant", *SWEEP_PARAMETERS, "date", "index_return", RETURN_COLUMN, "mean_turnover"]
+        ]
+        results.to_parquet(results_path, index=False)
+        return results
@@ -0,0 +1,163 @@
+import numpy as np
+import pandas as pd
+
+
+INDEX_BASE_VALUE = 100
+RETURN_COLUMN = "Cumulative Index Return"
+
+
+def create_weight_matrix(index_composition: pd.DataFrame, universe: pd.Index) -> np.ndarray:
+    """
+    Dense (rebalance dates x universe) weight matrix of an index composition.
+    :param index_composition: DF of constituent weights with one row per rebalance date, NaN for non members
+    :param universe: Columns of the returns panel
+    :return: Float array with zero weight for companies outside the index
+    """
+    return np.nan_to_num(
+        index_composition.reindex(columns=universe).to_numpy(dtype=float)
+    )
+
+
+def assign_periods(
+    dates: pd.DatetimeIndex, period_starts, period_ends
+) -> np.ndarray:
+    """
+    Assign every date to the holding period containing it.
+    :param dates: Sorted dates of the returns panel
+    :param period_starts: Sorted first dates of the holding periods
+    :param period_ends: Last dates of the holding periods, inclusive
+    :return: Array with the period number of every date, -1 for dates outside all periods
+    """
+
+    dates = dates.to_numpy(dtype="datetime64[ns]")
+    starts = pd.DatetimeIndex(period_starts).to_numpy(dtype="datetime64[ns]")
+    ends = pd.DatetimeIndex(period_ends).to_numpy(dtype="datetime64[ns]")
+
+    periods = np.searchsorted(starts, dates, side="right") - 1
+    inside = periods >= 0
+    inside[inside] = dates[inside] <= ends[periods[inside]]
+    return np.where(inside, periods, -1)
+
+
+class ReplicationEngine:
+    """
+    Shared return engine of the index replications.
+
+    The returns are pivoted once into a float (dates x universe) matrix, every index composition
+    becomes a dense (rebalance dates x universe) weight matrix and the daily index returns of all
+    holding periods are computed in a single vectorized pass.
+
+    :param returns_df: DF of daily company returns with one row per date and one column per company
+    """
+
+    def __init__(self, returns_df: pd.DataFrame):
+        self.returns_df = returns_df.astype(float).sort_index()
+        # Missing returns do not contribute to the index return
+        self.returns = np.nan_to_num(self.returns_df.to_numpy())
+        self.dates = self.returns_df.index
+        self.universe = self.returns_df.columns
+
+    @classmethod
+    def from_panel(cls, data: pd.DataFrame, column: str, company_level: str):
+        """
+        Create the engine from a (company, date) indexed panel.
+        :param data: Panel with a MultiIndex of company and date
+        :param column: Column holding the daily returns
+        :param company_level: Index level of the company identifier
+        """
+        return cls(data[column].astype(float).unstack(company_level))
+
+    def simulate(
+        self,
+        index_composition: pd.DataFrame,
+        period_starts,
+        period_ends,
+        drift_weights: bool = False,
+    ) -> tuple:
+        """
+        Simulate the index over the holding periods of its rebalance dates.
+
+        With constant weights the rebalance weights apply to every day of the period, which
+        amounts to daily rebalancing. With drifting weights the index buys the rebalance weights
+        and holds them, so every position grows with its cumulative return until the next rebalance.
+        :param index_composition: DF of constituent weights with one row per rebalance date
+        :param period_starts: First date of the holding period of every rebalance date
+        :param period_ends: Last date, inclusive, of the holding period of every rebalance date
+        :param drift_weights: Let the weights drift with the returns instead of keeping them constant
+        :return: Tuple of a Series of daily index returns and a Series of the one-way turnover at every rebalance date
+        """
+
+        weights = create_weight_matrix(index_composition, self.universe)
+        periods = assign_periods(self.dates, period_starts, period_ends)
+        rows = periods >= 0
+        returns = self.returns[rows]
+        period_rows = periods[rows]
+
+        if drift_weights:
+            daily_returns, end_weights = self.drift(returns, weights, period_rows)
+        else:
+            # Row wise dot products of the daily returns with the weights of their period
+            daily_returns = np.einsum("ij,ij->i", returns, weights[period_rows])
+            end_weights = weights
+
+        # Share of the index traded to get from the weights before a rebalance to the new weights
+        turnover = np.full(len(weights), np.nan)
+        turnover[1:] = 0.5 * np.abs(weights[1:] - end_weights[:-1]).sum(axis=1)
+
+        return (
+            pd.Series(daily_returns, index=self.dates[rows].rename(None)),
+            pd.Series(turnover, index=index_composition.index, name="turnover"),
+        )
+
+    def drift(self, returns: np.ndarray, weights: np.ndarray, period_rows: np.ndarray) -> tuple:
+        """
+        Buy-and-hold index returns from cumulative-product matrices, one per holding period.
+        :return: Tuple of the daily index returns and the drifted weights at the end of every period
+        """
+
+        daily_returns = np.zeros(len(returns))
+        end_weights = weights.copy()
+        # Dates are sorted, so every period is a contiguous block of rows
+        bounds = np.searchsorted(period_rows, np.arange(len(weights) + 1))
+
+        for period, (start, stop) in enumerate(zip(bounds[:-1], bounds[1:])):
+            if start == stop:
+                continue
+            holdings = weights[period] * np.cumprod(1 + returns[start:stop], axis=0)
+            values = np.concatenate([[weights[period].sum()], holdings.sum(axis=1)])
+            np.divide(
+                values[1:] - values[:-1],
+                values[:-1],
+                out=daily_returns[start:stop],
+                where=values[:-1] != 0,
+            )
+            if values[-1] != 0:
+                end_weights[period] = holdings[-1] / values[-1]
+
+        return daily_returns, end_weights
+
+    def daily_index_returns(
+        self,
+        index_composition: pd.DataFrame,
+        period_starts,
+        period_ends,
+        drift_weights: bool = False,
+    ) -> pd.Series:
+        """
+        Daily index returns over all holding periods, see simulate.
+        """
+        return self.simulate(
+            index_composition, period_starts, period_ends, drift_weights
+        )[0]
+
+
+def create_cumulative_index(index_returns: pd.Series) -> pd.DataFrame:
+    """
+    Cumulative index development with a base value of 100.
+    :param index_returns: Series of daily index returns
+    :return: DF with the cumulative index development
+    """
+
+    cumulative_index_return = (1 + index_returns).cumprod().to_frame(RETURN_COLUMN)
+    # Normalize returns and create base value of 100
+    return (cumulative_index_return / cumulative_index_return.iloc[0]) * INDEX_BASE_VALUE
@@ -1,33 +1,75 @@
 import pandas as pd
 import numpy as np
 import os
+from capping import cap_weight_matrix
+from data_cache import PreparedDataCache
+from replication_engine import ReplicationEngine, create_cumulative_index
+
+
+# Index methodology: the 500 largest companies without capping
+CAPPING_PERCENT = None
+N_CONSTITUENTS = 500
+# Name of the cached panel, bump the version when read_data changes
+CACHE_NAME = "sp500esg-v1"
+# Ids and industry exposures repeat on every date and are parsed as categoricals
+COLUMN_TYPES = {
+    "permno": "category",
+    "ret": "float64",
+    "mktcap": "float64",
+    "environmental_normalized": "float64",
+    "social_normalized": "float64",
+    "governance_normalized": "float64",
+    "esg_normalized": "float64",
+    "industry exposure": "category",
+}
 
 
 class SP500ESGIndexReplication:
-    def __init__(self):
-        pass
-
-    def replicate_index(self, path: str, excluded_companies: list) -> pd.DataFrame:
+    # Methodology defaults, read by the parameter sweep for parameters missing in its grid
+    CAPPING_PERCENT = CAPPING_PERCENT
+    N_CONSTITUENTS = N_CONSTITUENTS
+
+    def __init__(self, cache_dir=None):
+        # With a cache directory the parsed raw data is stored and memory mapped on later runs
+        self.cache = PreparedDataCache(cache_dir) if cache_dir else None
+        # One-way turnover at every rebalance date for each rebalance factor, set by index_replication
+        self.turnover = {}
+
+    def replicate_index(
+        self, path: str, excluded_companies: list, drift_weights: bool = False
+    ) -> pd.DataFrame:
         """
         Combine steps to replicate S&P 500 ESG back to base date April 30th, 2010
         :param path: String to raw data
+        :param drift_weights: Hold the rebalance weights and let them drift instead of keeping them constant
         :return: Cumulative index development until today
         """
 
-        data_sp500 = self.data_preparation(path)
-        data_sp500 = self.evaluate_industry_exposure(data_sp500)
-        sp500_rebalance_factors = self.get_rebalance_factors_on_reference_date(
-            data_sp500
-        )
+        data_sp500, sp500_rebalance_factors = self.prepare_data(path)
         index_compositions = self.get_index_composition(
             sp500_rebalance_factors, data_sp500, excluded_companies
         )
         cumulative_index_returns = self.index_replication(
-            index_compositions, data_sp500
+            index_compositions, data_sp500, drift_weights
         )
 
         return cumulative_index_returns
 
+    def prepare_data(self, path: str) -> tuple:
+        """
+        Load the raw data and get the rebalance factors, the steps shared by all index variants
+        :param path: String to raw data
+        :return: Tuple of the prepared S&P 500 data and the dict of rebalance factors
+        """
+
+        data_sp500 = self.data_preparation(path)
+        data_sp500 = self.evaluate_industry_exposure(data_sp500)
+        sp500_rebalance_factors = self.get_rebalance_factors_on_reference_date(
+            data_sp500
+        )
+
+        return data_sp500, sp500_rebalance_factors
+
     def data_preparation(self, path: str) -> pd.DataFrame:
         """
         Prepare the data to replicate S&P 500 ESG back to the Base Date on April 30th, 2010.
@@ -35,10 +77,20 @@ class SP500ESGIndexReplication:
         :return: DF of S&P 500 raw data
         """
 
+        if self.cache is None:
+            return self.read_data(path)
+        return self.cache.load(path, CACHE_NAME, self.read_data)
+
+    def read_data(self, path: str) -> pd.DataFrame:
+        """
+        Parse the raw data with explicit types.
+        :param path: String to raw data
+        :return: DF of S&P 500 raw data indexed by permno and date
+        """
+
         data_sp500 = (
-            pd.read_csv(path, dtype=str)
+            pd.read_csv(path, dtype=COLUMN_TYPES, parse_dates=["date"])
             .drop(columns="Unnamed: 0")
-            .set_index(["permno", "date"])
             .rename(
                 columns={
                     "environmental_normalized": "environmental",
@@ -47,23 +99,11 @@ class SP500ESGIndexReplication:
                     "esg_normalized": "esg",
                 }
             )
-            .sort_index()
         )
         # Exclude data before January 1st, 2010 as base date of S&P500 ESG is April 30th, 2010
-        data_sp500 = data_sp500.loc[
-            data_sp500.index.get_level_values("date") >= "2010-01-01"
-        ]
-
-        # Setting the datetime format
-        data_sp500.index = pd.MultiIndex.from_arrays(
-            [
-                data_sp500.index.get_level_values("permno"),
-                pd.to_datetime(data_sp500.index.get_level_values("date")),
-            ],
-            names=["permno", "date"],
-        )
+        data_sp500 = data_sp500[data_sp500["date"] >= pd.Timestamp(2010, 1, 1)]
 
-        return data_sp500
+        return data_sp500.set_index(["permno", "date"]).sort_index()
 
     def evaluate_industry_exposure(self, data_sp500: pd.DataFrame) -> pd.DataFrame:
         """
@@ -76,15 +116,17 @@ class SP500ESGIndexReplication:
         non_esg = ["CW", "FA", "MC", "OS", "TC", "TP"]
 
         # We assume that companies with nan values are esg conform
-        data_sp500.loc[:, "industry exposure"] = data_sp500[
-            "industry exposure"
-        ].replace(np.nan, "0")
-
-        # Function to check if any string in non_esg is present in a given row of industry exposure
-        def check_non_esg(row):
-            return any(substring in row["industry exposure"] for substring in non_esg)
-
-        data_sp500["non esg"] = data_sp500.apply(check_non_esg, axis=1).astype(int)
+        industry_exposure = data_sp500["industry exposure"].astype("category")
+        if "0" not in industry_exposure.cat.categories:
+            industry_exposure = industry_exposure.cat.add_categories("0")
+        data_sp500["industry exposure"] = industry_exposure.fillna("0")
+
+        # Check if any string in non_esg is present in the industry exposure, once per distinct exposure
+        data_sp500["non esg"] = (
+            data_sp500["industry exposure"]
+            .str.contains("|".join(non_esg), regex=True)
+            .astype(int)
+        )
 
         return data_sp500
 
@@ -133,12 +175,16 @@ class SP500ESGIndexReplication:
         sp500_rebalance_factors: dict,
         data_sp500: pd.DataFrame,
         excluded_companies: list,
+        capping_percent: float = CAPPING_PERCENT,
+        n_constituents: int = N_CONSTITUENTS,
     ) -> dict:
         """
         Create the index compositions based on rebalance factors for the S&P 500 ESG index based on the reference date for rebalancing
         :param sp500_rebalance_factors: DF with rebalance factors for each company on reference day
         :param sp500_data: SP500 data including industry exposure
         :param excluded_companies: list with excluded companies
+        :param capping_percent: Optional maximum weight of a constituent in the market cap weighted index
+        :param n_constituents: Number of largest companies the index is selected from
         :return: Index composition for the S&P 500 ESG index based on the reference date for rebalancing
         """
 
@@ -157,129 +203,81 @@ class SP500ESGIndexReplication:
                 "Market capitalization data (mktcap) is required in rebalance_factors."
             )
 
-        # Determine the constituents based on market capitalization
-        mktcap_composition = pd.DataFrame()
-        top_500_permnos_by_date = {}
-        for date in mktcap_df.index:
-            constituents = mktcap_df.loc[
-                date
-            ].copy()  # Ensure to make a copy to avoid modifying original data
-            # Select the top 500 by market capitalization
-            constituents = (
-                constituents.sort_values(ascending=False)
-                .head(500)
-                .to_frame(name="mktcap")
-                .reset_index()
-            )
-            # Exclusion of companies without or missing 10K's
-            constituents = constituents[
-                ~constituents["permno"].isin(excluded_companies.astype(str))
-            ]
-            constituents.set_index("permno", inplace=True)
-            # Exclude companies based on non_esg_permnos
-            constituents.drop(
-                index=[
-                    permno for permno in non_esg_permnos if permno in constituents.index
-                ],
-                inplace=True,
+        # Select the largest companies by market capitalization on every rebalancing date,
+        # then remove companies without or missing 10K's and companies based on non_esg_permnos
+        excluded_permnos = non_esg_permnos.union(pd.Index(excluded_companies).astype(str))
+        constituents = (
+            mktcap_df.rank(axis=1, ascending=False, method="first") <= n_constituents
+        ) & ~mktcap_df.columns.isin(list(excluded_permnos))
+
+        # Get constituents weights, capped if the methodology has a cap
+        constituent_mktcap = mktcap_df.where(constituents)
+        if capping_percent is None:
+            mktcap_composition = constituent_mktcap.div(
+                constituent_mktcap.sum(axis=1), axis=0
             )
-            # Store the top 500 permnos for this date
-            top_500_permnos_by_date[date] = constituents.index.tolist()
-            # Get constituents weights including capping
-            constituent_weight = (
-                (constituents["mktcap"] / constituents["mktcap"].sum())
-                .to_frame(name=date)
-                .T
-            )
-            constituent_weight.index = [date]
-            mktcap_composition = pd.concat(
-                [mktcap_composition, constituent_weight], axis=0
+        else:
+            mktcap_composition, _ = cap_weight_matrix(
+                constituent_mktcap, capping_percent
             )
 
         # Store the market capitalization composition
-        index_composition_dict["mktcap"] = mktcap_composition
+        index_composition_dict["mktcap"] = mktcap_composition.dropna(axis=1, how="all")
 
-        # Iterate over each rebalance factor
+        # Use the same constituents for other factors and calculate their weights
         for factor, factor_df in sp500_rebalance_factors.items():
             if factor == "mktcap":
                 continue  # Skip mktcap as it's already processed
-            factor_composition = pd.DataFrame()
-            for date in factor_df.index:
-                # Use the top 500 permnos determined from the market cap
-                top_500_permnos = top_500_permnos_by_date.get(date, [])
-                constituents = (
-                    factor_df.loc[date, top_500_permnos].to_frame(name=factor).T
-                )
-                constituents.index = [date]
-                # Calculate the weights based on the factor
-                factor_weight_sum = constituents.sum(axis=1)
-                factor_weight = constituents.div(factor_weight_sum, axis=0)
-                factor_weight.index = [date]
-                factor_composition = pd.concat(
-                    [factor_composition, factor_weight], axis=0
-                )
+            factor_constituents = constituents.reindex(
+                index=factor_df.index, columns=factor_df.columns, fill_value=False
+            )
+            factor_values = factor_df.where(factor_constituents)
+            # Calculate the weights based on the factor
+            factor_composition = factor_values.div(factor_values.sum(axis=1), axis=0)
 
             # Store the factor composition
-            index_composition_dict[factor] = factor_composition
+            index_composition_dict[factor] = factor_composition.dropna(
+                axis=1, how="all"
+            )
+
         return index_composition_dict
 
+    def create_engine(self, data_sp500: pd.DataFrame) -> ReplicationEngine:
+        # Pivot the companies returns once into a float matrix shared by all factors
+        return ReplicationEngine.from_panel(data_sp500, "ret", "permno")
+
+    def create_periods(self, index_composition: pd.DataFrame) -> tuple:
+        # Every composition is held from May 1st until April 30th of the following year
+        years = index_composition.index.year
+        period_starts = [pd.Timestamp(year, 5, 1) for year in years]
+        period_ends = [pd.Timestamp(year + 1, 4, 30) for year in years]
+        return period_starts, period_ends
+
     def index_replication(
-        self, index_compositions: dict, data_sp500: pd.DataFrame
+        self,
+        index_compositions: dict,
+        data_sp500: pd.DataFrame,
+        drift_weights: bool = False,
     ) -> dict:
         """
         Replicate S&P 500 ESG back to base date April 30th, 2010
         :param index_compositions: Dict with index composition for each rebalance factor for the S&P 500 ESG index based on the reference date for rebalancing
         :param data_sp500: DF of S&P 500 raw data
+        :param drift_weights: Hold the rebalance weights and let them drift instead of keeping them constant
         :return: Cumulative index development until today for each rebalance factor
         """
 
         cumulative_index_returns = {}
+        engine = self.create_engine(data_sp500)
 
         for factor, index_composition in index_compositions.items():
-            # Create a df that only contains the companies returns
-            returns_df = data_sp500.reset_index().pivot(
-                index="date", columns="permno", values="ret"
-            )
-
-            index_returns = pd.DataFrame()
-            for year in index_composition.index.year:
-                # Calculate start and end dates for the rebalancing
-                start_date = pd.Timestamp(year, 5, 1)
-                end_date = start_date.replace(year=start_date.year + 1, month=4, day=30)
-
-                # Get index weights for the current year
-                index_weights_year = index_composition.loc[
-                    index_composition.index.year == year
-                ].dropna(axis=1)
-
-                # Get daily weighted returns per company
-                weighted_returns = pd.DataFrame(
-                    index=returns_df.loc[start_date:end_date].index,
-                    columns=returns_df.columns,
-                )
-
-                for permno in index_weights_year.columns:
-                    weighted_returns[permno] = returns_df.loc[start_date:end_date][
-                        permno
-                    ].astype(float) * pd.Series(
-                        index_weights_year[permno].values[0],
-                        index=returns_df.loc[start_date:end_date][permno].index,
-                    )
-
-                daily_index_return = weighted_returns.sum(axis=1)
-                index_returns = pd.concat([index_returns, daily_index_return])
-
-            cumulative_index_return = (
-                (1 + index_returns)
-                .cumprod()
-                .rename(columns={0: "Cumulative Index Return"})
+            period_starts, period_ends = self.create_periods(index_composition)
+            index_returns, turnover = engine.simulate(
+                index_composition, period_starts, period_ends, drift_weights
             )
-            # Normalize returns and create base value of 100
-            cumulative_index_return = (
-                cumulative_index_return / cumulative_index_return.iloc[0]
-            ) * 100
             # Add the cumulative index return to the dictionary
             factor_name = factor.replace("_index_composition", "")
-            cumulative_index_returns[factor_name] = cumulative_index_return
+            cumulative_index_returns[factor_name] = create_cumulative_index(index_returns)
+            self.turnover[factor_name] = turnover
 
         return cumulative_index_returns
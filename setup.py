@@ -4,4 +4,9 @@ setup(
     name='esg_investment_returns',
     version='0.1',
     packages=find_packages(include=['financial_report_analyzer', 'index_replication']),
+    entry_points={
+        'console_scripts': [
+            'financial_report_analyzer=financial_report_analyzer.cli:main',
+        ],
+    },
 )
@@ -0,0 +1,6 @@
+import sys
+from pathlib import Path
+
+
+# The index replication modules import each other by module name, like their scripts
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "index_replication"))
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+from capping import CAPPING_ERROR, cap_weight_matrix, solve_capping
+
+
+def iterative_capping(amounts, capping_percent, error=CAPPING_ERROR):
+    # Reference loop: cap every group above the cap and spread its excess over the uncapped groups
+    values = np.array(amounts, dtype=float)
+    cap = capping_percent * values.sum()
+    uncapped = np.ones(len(values), dtype=bool)
+    while (values > cap + error).any():
+        for i in range(len(values)):
+            if values[i] > cap + error:
+                excess = values[i] - cap
+                values[i] = cap
+                uncapped[i] = False
+                remaining = values[uncapped].sum()
+                values[uncapped] *= (remaining + excess) / remaining
+    return values
+
+
+def test_solve_capping_matches_iterative_capping():
+    rng = np.random.default_rng(0)
+    for _ in range(100):
+        group_totals = rng.lognormal(8, 1.5, rng.integers(15, 60))
+        capped_totals, _, stats = solve_capping(group_totals, 0.07)
+
+        np.testing.assert_allclose(
+            capped_totals, iterative_capping(group_totals, 0.07), rtol=1e-10
+        )
+        assert stats["converged"]
+
+
+def test_cap_weight_matrix_matches_iterative_capping():
+    rng = np.random.default_rng(1)
+    amounts = rng.lognormal(8, 1.5, (200, 40))
+    # Non members of a row are NaN
+    amounts[rng.random(amounts.shape) < 0.3] = np.nan
+    amounts[:, :12] = rng.lognormal(8, 1.5, (200, 12))
+
+    weights, stats = cap_weight_matrix(amounts, 0.1)
+
+    for row, weight in zip(amounts, weights):
+        members = ~np.isnan(row)
+        expected = iterative_capping(row[members], 0.1)
+        np.testing.assert_allclose(
+            weight[members], expected / expected.sum(), rtol=1e-10
+        )
+        assert np.isnan(weight[~members]).all()
+    np.testing.assert_array_equal(stats["constituents"], (~np.isnan(amounts)).sum(axis=1))
+
+
+def test_cap_weight_matrix_keeps_empty_rows_empty():
+    amounts = np.full((3, 20), np.nan)
+    amounts[1] = np.arange(1, 21)
+
+    weights, stats = cap_weight_matrix(amounts, 0.07)
+
+    assert np.isnan(weights[[0, 2]]).all()
+    assert np.isclose(weights[1].sum(), 1)
+    assert weights[1].max() <= 0.07 + 1e-12
+    assert stats["constituents"].tolist() == [0, 20, 0]
+
+
+def test_cap_weight_matrix_rejects_implausible_caps():
+    with pytest.raises(ValueError):
+        cap_weight_matrix(np.ones((1, 5)), 0.1)
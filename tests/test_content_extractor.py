@@ -0,0 +1,36 @@
+import random
+from financial_report_analyzer.content_extractor import (
+    SENTENCE_SEPARATOR,
+    SPECIAL_CHARACTERS,
+    TextExtractor,
+)
+
+
+def random_sentences(rng, count):
+    alphabet = ["a", "B", "7", ".", " ", "  ", "\t", "\n", "\xa0", " ", *SPECIAL_CHARACTERS]
+    return [
+        "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 30)))
+        for _ in range(count)
+    ]
+
+
+def test_clean_batch_matches_clean():
+    rng = random.Random(0)
+    extractor = TextExtractor(None)
+    for _ in range(200):
+        sentences = random_sentences(rng, rng.randint(1, 20))
+        assert extractor.clean_batch(sentences) == [
+            extractor.clean(sentence) for sentence in sentences
+        ]
+
+
+def test_clean_batch_with_separator_in_sentences():
+    extractor = TextExtractor(None)
+    sentences = [f"a{SENTENCE_SEPARATOR}b ", " c  d", ""]
+    assert extractor.clean_batch(sentences) == [
+        extractor.clean(sentence) for sentence in sentences
+    ]
+
+
+def test_clean_batch_of_no_sentences():
+    assert TextExtractor(None).clean_batch([]) == []
@@ -0,0 +1,29 @@
+import pytest
+from financial_report_analyzer.utils import atomic_path
+
+
+def test_atomic_path_replaces_target(tmp_path):
+    target = tmp_path / "entry.json"
+    target.write_text("old")
+
+    with atomic_path(target) as temporary_path:
+        temporary_path.write_text("new")
+
+    assert target.read_text() == "new"
+    assert list(tmp_path.iterdir()) == [target]
+
+
+@pytest.mark.parametrize("directory", [False, True])
+def test_atomic_path_removes_failed_writes(tmp_path, directory):
+    target = tmp_path / "snapshot"
+
+    with pytest.raises(RuntimeError):
+        with atomic_path(target) as temporary_path:
+            if directory:
+                temporary_path.mkdir()
+                (temporary_path / "model.onnx").write_text("partial")
+            else:
+                temporary_path.write_text("partial")
+            raise RuntimeError("write failed")
+
+    assert list(tmp_path.iterdir()) == []